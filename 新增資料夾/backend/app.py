@@ -1,531 +1,667 @@
-from flask import Flask, request, jsonify, make_response
-from flask_cors import CORS
-from models import User, init_db
-from auth import hash_password, verify_password, generate_token, verify_token, require_auth
-from datetime import datetime, timedelta
-import secrets
-
-app = Flask(__name__)
-app.config['SECRET_KEY'] = secrets.token_urlsafe(32)
-CORS(app, supports_credentials=True)  # 允許跨域請求並支持憑證
-
-# 初始化資料庫
-init_db()
-
-@app.route('/api/login', methods=['POST'])
-def login():
-    """登錄 API - 專業版本"""
-    try:
-        data = request.get_json()
-        username = data.get('username')
-        password = data.get('password')
-        remember_me = data.get('remember_me', False)
-        
-        if not username or not password:
-            return jsonify({'message': '請輸入帳號和密碼'}), 400
-        
-        # 獲取客戶端信息
-        ip_address = request.remote_addr
-        user_agent = request.headers.get('User-Agent', '')
-        
-        # 檢查用戶是否存在
-        user = User.get_by_username(username)
-        
-        if not user:
-            # 記錄失敗（為了安全，不洩露用戶是否存在）
-            User.record_login_failure(username, ip_address, user_agent)
-            return jsonify({'message': '帳號或密碼錯誤'}), 401
-        
-        # 檢查帳號是否被鎖定
-        if User.is_locked(username):
-            return jsonify({
-                'message': '帳號因多次登錄失敗已被鎖定，請稍後再試',
-                'locked': True
-            }), 423  # 423 Locked
-        
-        # 驗證密碼
-        if not verify_password(password, user.password):
-            User.record_login_failure(username, ip_address, user_agent)
-            return jsonify({'message': '帳號或密碼錯誤'}), 401
-        
-        # 登錄成功
-        User.record_login_success(username, ip_address, user_agent)
-        
-        # 生成 token
-        expiration_hours = 720 if remember_me else 24  # 記住我：30天，否則24小時
-        token = generate_token(user.id, user.username, expiration_hours)
-        
-        # 保存 session
-        expires_at = (datetime.now() + timedelta(hours=expiration_hours)).isoformat()
-        User.save_session(user.id, token, ip_address, user_agent, expires_at)
-        
-        response = make_response(jsonify({
-            'message': '登入成功',
-            'user': {
-                'id': user.id,
-                'username': user.username,
-                'email': user.email,
-                'last_login': user.last_login
-            },
-            'token': token
-        }), 200)
-        
-        # 設置 HTTP-only Cookie（額外安全層）
-        response.set_cookie(
-            'auth_token',
-            token,
-            httponly=True,
-            secure=False,  # 生產環境應設為 True（HTTPS）
-            samesite='Lax',
-            max_age=expiration_hours * 3600
-        )
-        
-        return response
-            
-    except Exception as e:
-        return jsonify({'message': f'伺服器錯誤: {str(e)}'}), 500
-
-@app.route('/api/logout', methods=['POST'])
-@require_auth
-def logout():
-    """登出 API"""
-    try:
-        token = None
-        if 'Authorization' in request.headers:
-            token = request.headers['Authorization'].split(' ')[1]
-        elif request.cookies.get('auth_token'):
-            token = request.cookies.get('auth_token')
-        
-        if token:
-            User.delete_session(token)
-        
-        response = make_response(jsonify({'message': '已成功登出'}), 200)
-        response.set_cookie('auth_token', '', expires=0)
-        return response
-    except Exception as e:
-        return jsonify({'message': f'伺服器錯誤: {str(e)}'}), 500
-
-@app.route('/api/auth/verify', methods=['GET'])
-@require_auth
-def verify_auth():
-    """驗證當前認證狀態"""
-    try:
-        user_id = request.current_user['user_id']
-        user = User.get_by_id(user_id)
-        
-        if not user:
-            return jsonify({'message': '用戶不存在'}), 404
-        
-        return jsonify({
-            'authenticated': True,
-            'user': {
-                'id': user.id,
-                'username': user.username,
-                'email': user.email,
-                'last_login': user.last_login,
-                'created_at': user.created_at
-            }
-        }), 200
-    except Exception as e:
-        return jsonify({'message': f'伺服器錯誤: {str(e)}'}), 500
-
-@app.route('/api/register', methods=['POST'])
-def register():
-    """註冊 API - 升級版本"""
-    try:
-        data = request.get_json()
-        username = data.get('username')
-        password = data.get('password')
-        email = data.get('email')
-        
-        if not username or not password:
-            return jsonify({'message': '請輸入帳號和密碼'}), 400
-        
-        # 驗證用戶名格式
-        if len(username) < 3 or len(username) > 20:
-            return jsonify({'message': '用戶名長度應在3-20個字元之間'}), 400
-        
-        # 驗證密碼強度
-        if len(password) < 6:
-            return jsonify({'message': '密碼長度至少需要6個字元'}), 400
-        
-        # 檢查用戶是否已存在
-        if User.get_by_username(username):
-            return jsonify({'message': '帳號已存在'}), 400
-        
-        # 創建新用戶（使用 bcrypt 加密）
-        hashed_password = hash_password(password)
-        User.create(username, hashed_password, email)
-        
-        return jsonify({'message': '註冊成功'}), 201
-        
-    except Exception as e:
-        return jsonify({'message': f'伺服器錯誤: {str(e)}'}), 500
-
-@app.route('/api/guest-login', methods=['POST'])
-def guest_login():
-    """訪客登入 API"""
-    try:
-        import random
-        import string
-        
-        # 生成唯一的訪客帳號
-        guest_id = ''.join(random.choices(string.ascii_lowercase + string.digits, k=8))
-        username = f'guest_{guest_id}'
-        
-        # 檢查是否已存在（極低機率）
-        while User.get_by_username(username):
-            guest_id = ''.join(random.choices(string.ascii_lowercase + string.digits, k=8))
-            username = f'guest_{guest_id}'
-        
-        # 生成隨機密碼
-        password = ''.join(random.choices(string.ascii_letters + string.digits, k=12))
-        
-        # 創建訪客帳號
-        hashed_password = hash_password(password)
-        user = User.create(username, hashed_password, None)
-        
-        # 獲取客戶端信息
-        ip_address = request.remote_addr
-        user_agent = request.headers.get('User-Agent', '')
-        
-        # 記錄登錄成功
-        User.record_login_success(username, ip_address, user_agent)
-        
-        # 生成 token（訪客token 24小時有效）
-        token = generate_token(user.id, username, 24)
-        
-        # 保存 session
-        expires_at = (datetime.now() + timedelta(hours=24)).isoformat()
-        User.save_session(user.id, token, ip_address, user_agent, expires_at)
-        
-        response = make_response(jsonify({
-            'message': '訪客登入成功',
-            'user': {
-                'id': user.id,
-                'username': user.username,
-                'isGuest': True
-            },
-            'token': token
-        }), 200)
-        
-        # 設置 HTTP-only Cookie
-        response.set_cookie(
-            'auth_token',
-            token,
-            httponly=True,
-            secure=False,
-            samesite='Lax',
-            max_age=24 * 3600
-        )
-        
-        return response
-        
-    except Exception as e:
-        return jsonify({'message': f'伺服器錯誤: {str(e)}'}), 500
-
-@app.route('/api/oauth/google', methods=['POST'])
-def oauth_google():
-    """Google OAuth 登入"""
-    try:
-        data = request.get_json()
-        token = data.get('token')
-        
-        if not token:
-            return jsonify({'message': '缺少 Google token'}), 400
-        
-        # 驗證 Google token
-        try:
-            # 使用 Google token info endpoint 驗證
-            response = requests.get(
-                f'https://www.googleapis.com/oauth2/v3/tokeninfo?id_token={token}'
-            )
-            
-            if response.status_code != 200:
-                return jsonify({'message': '無效的 Google token'}), 401
-            
-            user_info = response.json()
-            
-            # 提取用戶信息
-            google_id = user_info.get('sub')
-            email = user_info.get('email')
-            name = user_info.get('name', '')
-            picture = user_info.get('picture', '')
-            
-            if not google_id or not email:
-                return jsonify({'message': '無法獲取 Google 用戶信息'}), 400
-            
-            # 查找或創建用戶
-            # 先檢查是否已有相同 email 的用戶
-            user = User.get_by_email(email)
-            
-            if not user:
-                # 創建新用戶（使用 Google ID 作為用戶名前綴）
-                username = f'google_{google_id[:8]}'
-                # 確保用戶名唯一
-                original_username = username
-                counter = 1
-                while User.get_by_username(username):
-                    username = f'{original_username}_{counter}'
-                    counter += 1
-                
-                # 使用隨機密碼（OAuth 用戶不需要密碼）
-                random_password = secrets.token_urlsafe(32)
-                hashed_password = hash_password(random_password)
-                user = User.create(username, hashed_password, email)
-            
-            # 記錄登錄成功
-            ip_address = request.remote_addr
-            user_agent = request.headers.get('User-Agent', '')
-            User.record_login_success(user.username, ip_address, user_agent)
-            
-            # 生成 token
-            token = generate_token(user.id, user.username, 24)
-            
-            # 保存 session
-            expires_at = (datetime.now() + timedelta(hours=24)).isoformat()
-            User.save_session(user.id, token, ip_address, user_agent, expires_at)
-            
-            response = make_response(jsonify({
-                'message': 'Google 登入成功',
-                'user': {
-                    'id': user.id,
-                    'username': user.username,
-                    'email': user.email,
-                    'isOAuth': True,
-                    'oauthProvider': 'google'
-                },
-                'token': token
-            }), 200)
-            
-            # 設置 Cookie
-            response.set_cookie(
-                'auth_token',
-                token,
-                httponly=True,
-                secure=False,
-                samesite='Lax',
-                max_age=24 * 3600
-            )
-            
-            return response
-            
-        except requests.RequestException as e:
-            return jsonify({'message': f'Google 驗證失敗: {str(e)}'}), 500
-            
-    except Exception as e:
-        return jsonify({'message': f'伺服器錯誤: {str(e)}'}), 500
-
-@app.route('/api/oauth/apple', methods=['POST'])
-def oauth_apple():
-    """Apple Sign In 登入"""
-    try:
-        data = request.get_json()
-        identity_token = data.get('identity_token')
-        authorization_code = data.get('authorization_code')
-        user_info = data.get('user', {})
-        
-        if not identity_token:
-            return jsonify({'message': '缺少 Apple identity token'}), 400
-        
-        # 驗證 Apple token (簡化版 - 生產環境需要完整驗證)
-        try:
-            # 這裡應該驗證 Apple JWT token
-            # 簡化處理：直接解析 token 獲取信息
-            import base64
-            
-            # 解析 JWT token (不驗證簽名 - 僅用於開發)
-            parts = identity_token.split('.')
-            if len(parts) != 3:
-                return jsonify({'message': '無效的 Apple token 格式'}), 401
-            
-            # 解碼 payload
-            payload = json.loads(base64.urlsafe_b64decode(parts[1] + '==').decode('utf-8'))
-            
-            # 提取用戶信息
-            apple_id = payload.get('sub')
-            email = user_info.get('email') or payload.get('email')
-            
-            if not apple_id:
-                return jsonify({'message': '無法獲取 Apple 用戶 ID'}), 400
-            
-            # 查找或創建用戶
-            user = None
-            if email:
-                user = User.get_by_email(email)
-            
-            if not user:
-                # 創建新用戶
-                username = f'apple_{apple_id[:8]}'
-                # 確保用戶名唯一
-                original_username = username
-                counter = 1
-                while User.get_by_username(username):
-                    username = f'{original_username}_{counter}'
-                    counter += 1
-                
-                # 使用隨機密碼
-                random_password = secrets.token_urlsafe(32)
-                hashed_password = hash_password(random_password)
-                user = User.create(username, hashed_password, email)
-            
-            # 記錄登錄成功
-            ip_address = request.remote_addr
-            user_agent = request.headers.get('User-Agent', '')
-            User.record_login_success(user.username, ip_address, user_agent)
-            
-            # 生成 token
-            token = generate_token(user.id, user.username, 24)
-            
-            # 保存 session
-            expires_at = (datetime.now() + timedelta(hours=24)).isoformat()
-            User.save_session(user.id, token, ip_address, user_agent, expires_at)
-            
-            response = make_response(jsonify({
-                'message': 'Apple 登入成功',
-                'user': {
-                    'id': user.id,
-                    'username': user.username,
-                    'email': user.email,
-                    'isOAuth': True,
-                    'oauthProvider': 'apple'
-                },
-                'token': token
-            }), 200)
-            
-            # 設置 Cookie
-            response.set_cookie(
-                'auth_token',
-                token,
-                httponly=True,
-                secure=False,
-                samesite='Lax',
-                max_age=24 * 3600
-            )
-            
-            return response
-            
-        except Exception as e:
-            return jsonify({'message': f'Apple 驗證失敗: {str(e)}'}), 500
-            
-    except Exception as e:
-        return jsonify({'message': f'伺服器錯誤: {str(e)}'}), 500
-
-@app.route('/api/forgot-password', methods=['POST'])
-def forgot_password():
-    """忘記密碼 - 請求重置碼"""
-    try:
-        data = request.get_json()
-        username = data.get('username')
-        
-        if not username:
-            return jsonify({'message': '請輸入帳號'}), 400
-        
-        # 檢查用戶是否存在
-        user = User.get_by_username(username)
-        
-        if not user:
-            # 為了安全，即使用戶不存在也返回成功訊息
-            return jsonify({'message': '如果帳號存在，重置碼已生成'}), 200
-        
-        # 生成重置 token
-        token = secrets.token_urlsafe(32)
-        expires_at = datetime.now() + timedelta(hours=1)  # 1小時後過期
-        
-        # 保存 token 到資料庫
-        User.set_reset_token(username, token, expires_at)
-        
-        # 實際應用中，這裡應該發送郵件
-        return jsonify({
-            'message': '重置碼已生成',
-            'token': token,
-            'expires_at': expires_at.isoformat()
-        }), 200
-        
-    except Exception as e:
-        return jsonify({'message': f'伺服器錯誤: {str(e)}'}), 500
-
-@app.route('/api/reset-password', methods=['POST'])
-def reset_password():
-    """重置密碼"""
-    try:
-        data = request.get_json()
-        username = data.get('username')
-        token = data.get('token')
-        new_password = data.get('new_password')
-        
-        if not username or not token or not new_password:
-            return jsonify({'message': '請填寫完整信息'}), 400
-        
-        # 驗證密碼長度
-        if len(new_password) < 6:
-            return jsonify({'message': '密碼長度至少需要6個字元'}), 400
-        
-        # 根據 token 查找用戶
-        user = User.get_by_reset_token(token)
-        
-        if not user:
-            return jsonify({'message': '無效的重置碼'}), 400
-        
-        # 驗證用戶名是否匹配
-        if user.username != username:
-            return jsonify({'message': '帳號與重置碼不匹配'}), 400
-        
-        # 檢查 token 是否過期
-        if user.reset_token_expires:
-            if isinstance(user.reset_token_expires, str):
-                expires_at = datetime.fromisoformat(user.reset_token_expires.replace('Z', '+00:00'))
-            else:
-                expires_at = user.reset_token_expires
-            
-            if datetime.now() > expires_at:
-                return jsonify({'message': '重置碼已過期，請重新申請'}), 400
-        
-        # 更新密碼（使用 bcrypt）
-        hashed_password = hash_password(new_password)
-        User.update_password(username, hashed_password)
-        
-        return jsonify({'message': '密碼重置成功'}), 200
-        
-    except Exception as e:
-        return jsonify({'message': f'伺服器錯誤: {str(e)}'}), 500
-
-@app.route('/api/user/profile', methods=['GET'])
-@require_auth
-def get_user_profile():
-    """獲取用戶資料"""
-    try:
-        user_id = request.current_user['user_id']
-        user = User.get_by_id(user_id)
-        
-        if not user:
-            return jsonify({'message': '用戶不存在'}), 404
-        
-        return jsonify({
-            'id': user.id,
-            'username': user.username,
-            'email': user.email,
-            'last_login': user.last_login,
-            'created_at': user.created_at
-        }), 200
-    except Exception as e:
-        return jsonify({'message': f'伺服器錯誤: {str(e)}'}), 500
-
-@app.route('/api/users', methods=['GET'])
-@require_auth
-def get_users():
-    """獲取所有用戶列表（需要認證）"""
-    try:
-        users = User.get_all()
-        # 不返回敏感信息
-        return jsonify([{
-            'id': u.id,
-            'username': u.username,
-            'email': u.email,
-            'created_at': u.created_at
-        } for u in users]), 200
-    except Exception as e:
-        return jsonify({'message': f'伺服器錯誤: {str(e)}'}), 500
-
-if __name__ == '__main__':
-    app.run(debug=True, port=5000)
+from flask import Flask, Blueprint, current_app, g, request, jsonify, make_response, Response, stream_with_context
+from flask_cors import CORS
+from models import User, init_db, start_background_tasks, LOGIN_OK, LOGIN_LOCKED, EXISTS_COLUMNS
+from auth import (hash_password, verify_password, generate_token, generate_guest_token, verify_token, require_auth,
+                  revoke_token, PasswordPoolBusy, needs_rehash, rehash_in_background)
+from rate_limit import LoginRateLimiter
+from oauth import verify_google_id_token, verify_apple_identity_token, email_verified, KeyFetchError
+from json_provider import FastJSONProvider
+from datetime import datetime, timedelta
+import hmac
+import os
+import secrets
+import math
+import time
+import metrics
+import tracing
+from profiler import profiler, install_signal_handler, PROFILE_SECONDS
+
+api = Blueprint('api', __name__)
+
+# 登錄速率限制（依 IP 與用戶名）
+login_rate_limiter = LoginRateLimiter()
+
+@metrics.registry.collector
+def _collect_rate_limit_stats():
+    """匯出登錄限速的允許與拒絕次數（停用的限制器不輸出）"""
+    samples = []
+    for limiter, stats in login_rate_limiter.stats().items():
+        if stats is None:
+            continue
+        for result in ('allowed', 'rejected'):
+            samples.append(('npc_rate_limit_requests_total', metrics.labels(limiter=limiter, result=result), stats[result]))
+    return samples
+
+# /api/users 分頁大小
+USERS_PAGE_SIZE = 100
+USERS_PAGE_MAX = 1000
+
+# 設定後 /metrics 需要 Authorization: Bearer <METRICS_TOKEN>
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# 設定後才開放 /api/admin/profile，需要 Authorization: Bearer <PROFILE_TOKEN>
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+
+def create_app(init_database=True, start_background=True):
+    """應用工廠
+    
+    init_database 套用資料庫遷移；start_background 啟動背景清理與撤銷清單同步。
+    prefork 部署（見 wsgi.py、gunicorn.conf.py）由 master 預載時遷移一次，背景工作在各 worker fork 之後才啟動。
+    """
+    app = Flask(__name__)
+    app.json = FastJSONProvider(app)
+    app.config['SECRET_KEY'] = secrets.token_urlsafe(32)
+    CORS(app, supports_credentials=True, expose_headers=['Link', 'Retry-After', 'ETag', 'X-Trace-Id'])  # 允許跨域請求並支持憑證
+    app.register_blueprint(api)
+    
+    if init_database:
+        init_db()
+    if start_background:
+        start_background_tasks()
+    return app
+
+def guest_user(payload):
+    """由訪客 token 的 payload 組成用戶資料"""
+    return {
+        'id': None,
+        'username': payload['username'],
+        'email': None,
+        'last_login': None,
+        'created_at': None,
+        'isGuest': True
+    }
+
+def conditional_response(etag, build):
+    """條件式 GET：If-None-Match 命中時直接回應 304，不呼叫 build（省去序列化與傳輸）"""
+    if request.if_none_match.contains_weak(etag):
+        response = make_response('', 304)
+    else:
+        response = make_response(build(), 200)
+    response.set_etag(etag, weak=True)
+    # 需要認證的資料：瀏覽器可保存但每次都要重新驗證
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@api.before_app_request
+def start_request_metrics():
+    """記錄請求開始時間與處理中的請求數（以端點名稱為標籤，未匹配的路徑歸為 unmatched）"""
+    g.metrics_started = time.perf_counter()
+    g.metrics_labels = metrics.labels(endpoint=request.endpoint or 'unmatched')
+    metrics.registry.gauge_add('npc_http_requests_in_flight', g.metrics_labels, 1)
+    g.trace_token = tracing.begin()
+
+@api.after_app_request
+def record_request_metrics(response):
+    started = g.get('metrics_started')
+    if started is not None:
+        endpoint = g.metrics_labels + (('method', request.method),)
+        metrics.registry.observe('npc_http_request_duration_seconds', time.perf_counter() - started, endpoint)
+        metrics.registry.inc('npc_http_requests_total', endpoint + (('status', str(response.status_code)),))
+    # 慢請求或被取樣時寫入追蹤紀錄，並以 X-Trace-Id 標頭對應到紀錄
+    trace_id = tracing.finish(
+        method=request.method, path=request.path, endpoint=request.endpoint, status=response.status_code
+    )
+    if trace_id is not None:
+        response.headers['X-Trace-Id'] = trace_id
+    return response
+
+@api.teardown_app_request
+def finish_request_metrics(error=None):
+    if g.get('metrics_started') is not None:
+        metrics.registry.gauge_add('npc_http_requests_in_flight', g.metrics_labels, -1)
+        tracing.end(g.get('trace_token'))
+
+def busy_response(error):
+    """bcrypt 工作池已滿時快速回應 503，避免請求執行緒被耗盡"""
+    response = make_response(jsonify({'message': str(error)}), 503)
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+@api.route('/api/login', methods=['POST'])
+def login():
+    """登錄 API - 專業版本"""
+    try:
+        data = request.get_json()
+        username = data.get('username')
+        password = data.get('password')
+        remember_me = data.get('remember_me', False)
+        
+        if not username or not password:
+            return jsonify({'message': '請輸入帳號和密碼'}), 400
+        # 速率限制與密碼驗證都假設為字串，其他 JSON 型別直接拒絕
+        if not isinstance(username, str) or not isinstance(password, str):
+            return jsonify({'message': '帳號和密碼格式不正確'}), 400
+        
+        # 獲取客戶端信息
+        ip_address = request.remote_addr
+        user_agent = request.headers.get('User-Agent', '')
+        
+        # 在任何資料庫查詢或 bcrypt 之前先擋下過於頻繁的嘗試
+        retry_after = login_rate_limiter.check(ip_address, username)
+        if retry_after:
+            response = make_response(jsonify({'message': '嘗試次數過多，請稍後再試'}), 429)
+            response.headers['Retry-After'] = str(math.ceil(retry_after))
+            return response
+        
+        expiration_hours = 720 if remember_me else 24  # 記住我：30天，否則24小時
+        
+        def issue_token(user):
+            token = generate_token(user.id, user.username, expiration_hours)
+            expires_at = (datetime.now() + timedelta(hours=expiration_hours)).isoformat()
+            return token, expires_at
+        
+        # 鎖定檢查、密碼驗證、更新失敗次數、登錄日誌與 session 在同一個交易中完成
+        status, user, token = User.authenticate_and_open_session(
+            username,
+            lambda hashed: verify_password(password, hashed),
+            issue_token,
+            ip_address,
+            user_agent
+        )
+        
+        if status == LOGIN_LOCKED:
+            return jsonify({
+                'message': '帳號因多次登錄失敗已被鎖定，請稍後再試',
+                'locked': True
+            }), 423  # 423 Locked
+        
+        if status != LOGIN_OK:
+            # 為了安全，不洩露用戶是否存在
+            return jsonify({'message': '帳號或密碼錯誤'}), 401
+        
+        # 舊的 SHA256 或工作因子過低的雜湊在背景升級
+        if needs_rehash(user.password):
+            old_hash = user.password
+            rehash_in_background(
+                password,
+                lambda new_hash: User.replace_password_hash(user.id, old_hash, new_hash)
+            )
+        
+        response = make_response(jsonify({
+            'message': '登入成功',
+            'user': {
+                'id': user.id,
+                'username': user.username,
+                'email': user.email,
+                'last_login': user.last_login
+            },
+            'token': token
+        }), 200)
+        
+        # 設置 HTTP-only Cookie（額外安全層）
+        response.set_cookie(
+            'auth_token',
+            token,
+            httponly=True,
+            secure=False,  # 生產環境應設為 True（HTTPS）
+            samesite='Lax',
+            max_age=expiration_hours * 3600
+        )
+        
+        return response
+            
+    except PasswordPoolBusy as e:
+        return busy_response(e)
+    except Exception as e:
+        return jsonify({'message': f'伺服器錯誤: {str(e)}'}), 500
+
+@api.route('/api/logout', methods=['POST'])
+@require_auth
+def logout():
+    """登出 API"""
+    try:
+        token = None
+        if 'Authorization' in request.headers:
+            token = request.headers['Authorization'].split(' ')[1]
+        elif request.cookies.get('auth_token'):
+            token = request.cookies.get('auth_token')
+        
+        if token:
+            User.delete_session(token)
+            revoke_token(token, request.current_user)
+        
+        response = make_response(jsonify({'message': '已成功登出'}), 200)
+        response.set_cookie('auth_token', '', expires=0)
+        return response
+    except Exception as e:
+        return jsonify({'message': f'伺服器錯誤: {str(e)}'}), 500
+
+@api.route('/api/auth/verify', methods=['GET'])
+@require_auth
+def verify_auth():
+    """驗證當前認證狀態"""
+    try:
+        if request.current_user.get('guest'):
+            return jsonify({'authenticated': True, 'user': guest_user(request.current_user)}), 200
+        
+        user_id = request.current_user['user_id']
+        user = User.get_profile(user_id)
+        
+        if not user:
+            return jsonify({'message': '用戶不存在'}), 404
+        
+        return conditional_response(
+            user.etag, lambda: jsonify({'authenticated': True, 'user': user.to_public_dict()})
+        )
+    except Exception as e:
+        return jsonify({'message': f'伺服器錯誤: {str(e)}'}), 500
+
+@api.route('/api/register', methods=['POST'])
+def register():
+    """註冊 API - 升級版本"""
+    try:
+        data = request.get_json()
+        username = data.get('username')
+        password = data.get('password')
+        email = data.get('email')
+        
+        if not username or not password:
+            return jsonify({'message': '請輸入帳號和密碼'}), 400
+        
+        # 驗證用戶名格式
+        if len(username) < 3 or len(username) > 20:
+            return jsonify({'message': '用戶名長度應在3-20個字元之間'}), 400
+        
+        # 驗證密碼強度
+        if len(password) < 6:
+            return jsonify({'message': '密碼長度至少需要6個字元'}), 400
+        
+        # 檢查用戶是否已存在
+        if User.get_by_username(username, EXISTS_COLUMNS):
+            return jsonify({'message': '帳號已存在'}), 400
+        
+        # 創建新用戶（使用 bcrypt 加密）
+        hashed_password = hash_password(password)
+        User.create(username, hashed_password, email)
+        
+        return jsonify({'message': '註冊成功'}), 201
+        
+    except PasswordPoolBusy as e:
+        return busy_response(e)
+    except Exception as e:
+        return jsonify({'message': f'伺服器錯誤: {str(e)}'}), 500
+
+@api.route('/api/guest-login', methods=['POST'])
+def guest_login():
+    """訪客登入 API"""
+    try:
+        # 訪客不建立用戶資料、不做 bcrypt，也不寫入登錄日誌與 session；
+        # 身分完全由簽名的 token 表示，註冊時才會建立 users 資料
+        guest_id = secrets.token_hex(4)
+        token = generate_guest_token(guest_id, 24)
+        user = guest_user({'username': f'guest_{guest_id}'})
+        
+        response = make_response(jsonify({
+            'message': '訪客登入成功',
+            'user': user,
+            'token': token
+        }), 200)
+        
+        # 設置 HTTP-only Cookie
+        response.set_cookie(
+            'auth_token',
+            token,
+            httponly=True,
+            secure=False,
+            samesite='Lax',
+            max_age=24 * 3600
+        )
+        
+        return response
+        
+    except Exception as e:
+        return jsonify({'message': f'伺服器錯誤: {str(e)}'}), 500
+
+@api.route('/api/oauth/google', methods=['POST'])
+def oauth_google():
+    """Google OAuth 登入"""
+    try:
+        data = request.get_json()
+        token = data.get('token')
+        
+        if not token:
+            return jsonify({'message': '缺少 Google token'}), 400
+        
+        # 驗證 Google token
+        try:
+            # 以快取的 Google 公鑰在本地驗證 ID token
+            try:
+                user_info = verify_google_id_token(token)
+            except ValueError:
+                return jsonify({'message': '無效的 Google token'}), 401
+            
+            # 提取用戶信息
+            google_id = user_info.get('sub')
+            email = user_info.get('email')
+            name = user_info.get('name', '')
+            picture = user_info.get('picture', '')
+            
+            if not google_id or not email:
+                return jsonify({'message': '無法獲取 Google 用戶信息'}), 400
+            # 以 email 連結既有帳號前，email 必須已由 Google 驗證，否則可冒用他人帳號
+            if not email_verified(user_info):
+                return jsonify({'message': 'Google 帳號的 email 尚未驗證'}), 403
+            
+            # 查找或創建用戶
+            # 先檢查是否已有相同 email 的用戶
+            user = User.get_by_email(email, ('id', 'username', 'email'))
+            
+            if not user:
+                # 創建新用戶（使用 Google ID 作為用戶名前綴）
+                username = f'google_{google_id[:8]}'
+                # 確保用戶名唯一
+                original_username = username
+                counter = 1
+                while User.get_by_username(username, EXISTS_COLUMNS):
+                    username = f'{original_username}_{counter}'
+                    counter += 1
+                
+                # 使用隨機密碼（OAuth 用戶不需要密碼）
+                random_password = secrets.token_urlsafe(32)
+                hashed_password = hash_password(random_password)
+                user = User.create(username, hashed_password, email)
+            
+            # 記錄登錄成功
+            ip_address = request.remote_addr
+            user_agent = request.headers.get('User-Agent', '')
+            User.record_login_success(user.username, ip_address, user_agent)
+            
+            # 生成 token
+            token = generate_token(user.id, user.username, 24)
+            
+            # 保存 session
+            expires_at = (datetime.now() + timedelta(hours=24)).isoformat()
+            User.save_session(user.id, token, ip_address, user_agent, expires_at)
+            
+            response = make_response(jsonify({
+                'message': 'Google 登入成功',
+                'user': {
+                    'id': user.id,
+                    'username': user.username,
+                    'email': user.email,
+                    'isOAuth': True,
+                    'oauthProvider': 'google'
+                },
+                'token': token
+            }), 200)
+            
+            # 設置 Cookie
+            response.set_cookie(
+                'auth_token',
+                token,
+                httponly=True,
+                secure=False,
+                samesite='Lax',
+                max_age=24 * 3600
+            )
+            
+            return response
+            
+        except KeyFetchError as e:
+            return jsonify({'message': f'Google 驗證失敗: {str(e)}'}), 500
+            
+    except PasswordPoolBusy as e:
+        return busy_response(e)
+    except Exception as e:
+        return jsonify({'message': f'伺服器錯誤: {str(e)}'}), 500
+
+@api.route('/api/oauth/apple', methods=['POST'])
+def oauth_apple():
+    """Apple Sign In 登入"""
+    try:
+        data = request.get_json()
+        identity_token = data.get('identity_token')
+        authorization_code = data.get('authorization_code')
+        
+        if not identity_token:
+            return jsonify({'message': '缺少 Apple identity token'}), 400
+        
+        # 驗證 Apple token：以快取的 Apple 公鑰在本地驗證 RS256 簽名
+        try:
+            try:
+                payload = verify_apple_identity_token(identity_token)
+            except ValueError:
+                return jsonify({'message': '無效的 Apple token'}), 401
+            
+            # 提取用戶信息
+            apple_id = payload.get('sub')
+            # 只信任已驗證簽名的 token 中的 email，避免以用戶端提供的 email 冒用既有帳號；
+            # 未經 Apple 驗證的 email 不用於連結既有帳號
+            email = payload.get('email') if email_verified(payload) else None
+            
+            if not apple_id:
+                return jsonify({'message': '無法獲取 Apple 用戶 ID'}), 400
+            
+            # 查找或創建用戶
+            user = None
+            if email:
+                user = User.get_by_email(email, ('id', 'username', 'email'))
+            
+            if not user:
+                # 創建新用戶
+                username = f'apple_{apple_id[:8]}'
+                # 確保用戶名唯一
+                original_username = username
+                counter = 1
+                while User.get_by_username(username, EXISTS_COLUMNS):
+                    username = f'{original_username}_{counter}'
+                    counter += 1
+                
+                # 使用隨機密碼
+                random_password = secrets.token_urlsafe(32)
+                hashed_password = hash_password(random_password)
+                user = User.create(username, hashed_password, email)
+            
+            # 記錄登錄成功
+            ip_address = request.remote_addr
+            user_agent = request.headers.get('User-Agent', '')
+            User.record_login_success(user.username, ip_address, user_agent)
+            
+            # 生成 token
+            token = generate_token(user.id, user.username, 24)
+            
+            # 保存 session
+            expires_at = (datetime.now() + timedelta(hours=24)).isoformat()
+            User.save_session(user.id, token, ip_address, user_agent, expires_at)
+            
+            response = make_response(jsonify({
+                'message': 'Apple 登入成功',
+                'user': {
+                    'id': user.id,
+                    'username': user.username,
+                    'email': user.email,
+                    'isOAuth': True,
+                    'oauthProvider': 'apple'
+                },
+                'token': token
+            }), 200)
+            
+            # 設置 Cookie
+            response.set_cookie(
+                'auth_token',
+                token,
+                httponly=True,
+                secure=False,
+                samesite='Lax',
+                max_age=24 * 3600
+            )
+            
+            return response
+            
+        except PasswordPoolBusy:
+            raise
+        except Exception as e:
+            return jsonify({'message': f'Apple 驗證失敗: {str(e)}'}), 500
+            
+    except PasswordPoolBusy as e:
+        return busy_response(e)
+    except Exception as e:
+        return jsonify({'message': f'伺服器錯誤: {str(e)}'}), 500
+
+@api.route('/api/forgot-password', methods=['POST'])
+def forgot_password():
+    """忘記密碼 - 請求重置碼"""
+    try:
+        data = request.get_json()
+        username = data.get('username')
+        
+        if not username:
+            return jsonify({'message': '請輸入帳號'}), 400
+        
+        # 檢查用戶是否存在
+        user = User.get_by_username(username, EXISTS_COLUMNS)
+        
+        if not user:
+            # 為了安全，即使用戶不存在也返回成功訊息
+            return jsonify({'message': '如果帳號存在，重置碼已生成'}), 200
+        
+        # 生成重置 token
+        token = secrets.token_urlsafe(32)
+        expires_at = datetime.now() + timedelta(hours=1)  # 1小時後過期
+        
+        # 保存 token 到資料庫
+        User.set_reset_token(username, token, expires_at)
+        
+        # 實際應用中，這裡應該發送郵件
+        return jsonify({
+            'message': '重置碼已生成',
+            'token': token,
+            'expires_at': expires_at.isoformat()
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'message': f'伺服器錯誤: {str(e)}'}), 500
+
+@api.route('/api/reset-password', methods=['POST'])
+def reset_password():
+    """重置密碼"""
+    try:
+        data = request.get_json()
+        username = data.get('username')
+        token = data.get('token')
+        new_password = data.get('new_password')
+        
+        if not username or not token or not new_password:
+            return jsonify({'message': '請填寫完整信息'}), 400
+        
+        # 驗證密碼長度
+        if len(new_password) < 6:
+            return jsonify({'message': '密碼長度至少需要6個字元'}), 400
+        
+        # 根據 token 查找用戶
+        user = User.get_by_reset_token(token)
+        
+        if not user:
+            return jsonify({'message': '無效的重置碼'}), 400
+        
+        # 驗證用戶名是否匹配
+        if user.username != username:
+            return jsonify({'message': '帳號與重置碼不匹配'}), 400
+        
+        # 檢查 token 是否過期
+        if user.reset_token_expires:
+            if isinstance(user.reset_token_expires, str):
+                expires_at = datetime.fromisoformat(user.reset_token_expires.replace('Z', '+00:00'))
+            else:
+                expires_at = user.reset_token_expires
+            
+            if datetime.now() > expires_at:
+                return jsonify({'message': '重置碼已過期，請重新申請'}), 400
+        
+        # 更新密碼（使用 bcrypt）
+        hashed_password = hash_password(new_password)
+        User.update_password(username, hashed_password)
+        
+        return jsonify({'message': '密碼重置成功'}), 200
+        
+    except PasswordPoolBusy as e:
+        return busy_response(e)
+    except Exception as e:
+        return jsonify({'message': f'伺服器錯誤: {str(e)}'}), 500
+
+@api.route('/api/user/profile', methods=['GET'])
+@require_auth
+def get_user_profile():
+    """獲取用戶資料"""
+    try:
+        if request.current_user.get('guest'):
+            return jsonify(guest_user(request.current_user)), 200
+        
+        user_id = request.current_user['user_id']
+        user = User.get_profile(user_id)
+        
+        if not user:
+            return jsonify({'message': '用戶不存在'}), 404
+        
+        return conditional_response(user.etag, lambda: jsonify(user.to_public_dict()))
+    except Exception as e:
+        return jsonify({'message': f'伺服器錯誤: {str(e)}'}), 500
+
+@api.route('/api/users', methods=['GET'])
+@require_auth
+def get_users():
+    """獲取用戶列表（需要認證）
+    
+    以 id 為游標分頁：?limit=100&after=<上一頁最後的 id>，下一頁位置放在 Link 標頭。
+    ?format=ndjson 時以 NDJSON 串流輸出 after 之後的所有用戶。
+    """
+    try:
+        try:
+            after = int(request.args.get('after', 0))
+            limit = int(request.args.get('limit', USERS_PAGE_SIZE))
+        except ValueError:
+            return jsonify({'message': 'after 與 limit 必須是整數'}), 400
+        
+        if after < 0 or limit < 1:
+            return jsonify({'message': 'after 不可為負數且 limit 必須大於 0'}), 400
+        
+        # 不返回敏感信息
+        if request.args.get('format') == 'ndjson':
+            dumps_line = current_app.json.dumps_line
+            
+            def generate():
+                for user in User.iter_public(after):
+                    yield dumps_line(user)
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+        
+        limit = min(limit, USERS_PAGE_MAX)
+        
+        def build():
+            users = User.get_page(after, limit)
+            response = make_response(jsonify(users), 200)
+            if len(users) == limit:
+                response.headers['Link'] = f'<{request.path}?after={users[-1]["id"]}&limit={limit}>; rel="next"'
+            return response
+        
+        return conditional_response(f'users-{User.list_version()}', build)
+    except Exception as e:
+        return jsonify({'message': f'伺服器錯誤: {str(e)}'}), 500
+
+@api.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus 文字格式的指標（多 worker 時彙總 METRICS_DIR 中所有 worker 的快照）"""
+    if METRICS_TOKEN:
+        supplied = request.headers.get('Authorization', '').removeprefix('Bearer ')
+        if not hmac.compare_digest(supplied, METRICS_TOKEN):
+            return jsonify({'message': '未授權'}), 401
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@api.route('/api/admin/profile', methods=['POST'])
+def start_profile():
+    """在處理此請求的 worker 上開始取樣分析，?seconds= 指定秒數（預設 PROFILE_SECONDS）"""
+    supplied = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    if not PROFILE_TOKEN or not hmac.compare_digest(supplied, PROFILE_TOKEN):
+        # 未啟用或未授權時不透露端點存在
+        return jsonify({'message': 'Not Found'}), 404
+    try:
+        seconds = float(request.args.get('seconds', PROFILE_SECONDS))
+    except ValueError:
+        return jsonify({'message': 'seconds 必須是數字'}), 400
+    
+    path = profiler.start(seconds)
+    if path is None:
+        return jsonify({'message': '已有取樣分析進行中'}), 409
+    return jsonify({'message': '取樣分析已開始', 'pid': os.getpid(), 'output': path}), 202
+
+if __name__ == '__main__':
+    install_signal_handler()
+    create_app().run(debug=True, port=5000)
@@ -1,90 +1,381 @@
-"""
-認證相關功能模組
-包含 JWT token 生成、驗證、密碼加密等
-"""
-import jwt
-import bcrypt
-import hashlib
-from datetime import datetime, timedelta
-import secrets
-import os
-
-# JWT 密鑰（生產環境應該從環境變數讀取）
-SECRET_KEY = os.environ.get('SECRET_KEY', secrets.token_urlsafe(32))
-JWT_ALGORITHM = 'HS256'
-JWT_EXPIRATION_HOURS = 24  # Token 24小時過期
-
-def hash_password(password):
-    """使用 bcrypt 加密密碼"""
-    salt = bcrypt.gensalt()
-    hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
-    return hashed.decode('utf-8')
-
-def verify_password(password, hashed):
-    """驗證密碼"""
-    try:
-        return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
-    except Exception:
-        # 兼容舊的 SHA256 密碼
-        sha256_hash = hashlib.sha256(password.encode()).hexdigest()
-        return sha256_hash == hashed
-
-def generate_token(user_id, username, expiration_hours=None):
-    """生成 JWT token"""
-    exp_hours = expiration_hours if expiration_hours else JWT_EXPIRATION_HOURS
-    payload = {
-        'user_id': user_id,
-        'username': username,
-        'exp': datetime.utcnow() + timedelta(hours=exp_hours),
-        'iat': datetime.utcnow()
-    }
-    token = jwt.encode(payload, SECRET_KEY, algorithm=JWT_ALGORITHM)
-    # PyJWT 2.x 返回字串，不需要 decode
-    if isinstance(token, bytes):
-        return token.decode('utf-8')
-    return token
-
-def verify_token(token):
-    """驗證 JWT token"""
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[JWT_ALGORITHM])
-        return payload
-    except jwt.ExpiredSignatureError:
-        return None
-    except jwt.InvalidTokenError:
-        return None
-
-def require_auth(f):
-    """認證裝飾器，保護需要登錄的路由"""
-    from functools import wraps
-    from flask import request, jsonify
-    
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        token = None
-        
-        # 從 Header 獲取 token
-        if 'Authorization' in request.headers:
-            auth_header = request.headers['Authorization']
-            try:
-                token = auth_header.split(' ')[1]  # Bearer <token>
-            except IndexError:
-                return jsonify({'message': '無效的認證格式'}), 401
-        
-        # 從 Cookie 獲取 token（備用方案）
-        if not token:
-            token = request.cookies.get('auth_token')
-        
-        if not token:
-            return jsonify({'message': '未授權，請先登錄'}), 401
-        
-        payload = verify_token(token)
-        if not payload:
-            return jsonify({'message': 'Token 無效或已過期'}), 401
-        
-        # 將用戶信息添加到請求上下文
-        request.current_user = payload
-        return f(*args, **kwargs)
-    
-    return decorated_function
-
+"""
+認證相關功能模組
+包含 JWT token 生成、驗證、密碼加密等
+"""
+import jwt
+import bcrypt
+import hashlib
+import hmac
+from datetime import datetime, timedelta
+import secrets
+import os
+import math
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from models import revocation_list
+import metrics
+import tracing
+
+# JWT 密鑰（生產環境應該從環境變數讀取）
+SECRET_KEY = os.environ.get('SECRET_KEY', secrets.token_urlsafe(32))
+JWT_ALGORITHM = 'HS256'
+JWT_EXPIRATION_HOURS = 24  # Token 24小時過期
+
+# 已驗證 token 快取設定：最多條目數與單一條目最長存活秒數（不會超過 token 自身的 exp）
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 10000))
+TOKEN_CACHE_TTL = int(os.environ.get('TOKEN_CACHE_TTL', 300))
+
+# bcrypt 工作池設定：同時運算的執行緒數與可排隊的請求數
+BCRYPT_WORKERS = int(os.environ.get('BCRYPT_WORKERS', os.cpu_count() or 2))
+BCRYPT_QUEUE_SIZE = int(os.environ.get('BCRYPT_QUEUE_SIZE', BCRYPT_WORKERS * 4))
+
+# bcrypt 工作因子，建議用 calibrate_bcrypt.py 依主機效能校準
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+
+class PasswordPoolBusy(Exception):
+    """密碼運算工作池已滿，應回應 503"""
+    def __init__(self, retry_after):
+        super().__init__('伺服器忙碌中，請稍後再試')
+        self.retry_after = retry_after
+
+class PasswordWorkerPool:
+    """大小固定的 bcrypt 工作池，排隊已滿時立即拒絕而不是佔住請求執行緒"""
+    
+    def __init__(self, workers=BCRYPT_WORKERS, queue_size=BCRYPT_QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._completed = 0
+        self._rejected = 0
+        self._total_wait = 0.0
+        self._total_run = 0.0
+        self._max_latency = 0.0
+    
+    def _get_executor(self):
+        # 延遲建立，避免在 fork 前就啟動執行緒
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.workers, thread_name_prefix='bcrypt'
+                    )
+        return self._executor
+    
+    def _retry_after(self):
+        """依目前排隊長度與平均耗時估算 Retry-After 秒數"""
+        with self._lock:
+            average = (self._total_wait + self._total_run) / self._completed if self._completed else 0.25
+            depth = self._pending
+        return max(1, math.ceil(depth * average / self.workers))
+    
+    def _timed(self, func, args, submitted):
+        started = time.perf_counter()
+        metrics.registry.observe('npc_bcrypt_queue_wait_seconds', started - submitted)
+        try:
+            return func(*args)
+        finally:
+            finished = time.perf_counter()
+            with self._lock:
+                self._completed += 1
+                self._total_wait += started - submitted
+                self._total_run += finished - started
+                self._max_latency = max(self._max_latency, finished - submitted)
+    
+    def submit_background(self, func, *args):
+        """背景執行 func，不等待結果；工作池忙碌時直接放棄並返回 False"""
+        if not self._slots.acquire(blocking=False):
+            return False
+        with self._lock:
+            self._pending += 1
+        
+        def done(_future):
+            with self._lock:
+                self._pending -= 1
+            self._slots.release()
+        
+        future = self._get_executor().submit(self._timed, func, args, time.perf_counter())
+        future.add_done_callback(done)
+        return True
+    
+    def run(self, func, *args):
+        """在工作池中執行 func，排隊已滿時拋出 PasswordPoolBusy"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            metrics.registry.inc('npc_bcrypt_rejected_total')
+            raise PasswordPoolBusy(self._retry_after())
+        with self._lock:
+            self._pending += 1
+        try:
+            future = self._get_executor().submit(self._timed, func, args, time.perf_counter())
+            return future.result()
+        finally:
+            with self._lock:
+                self._pending -= 1
+            self._slots.release()
+    
+    def stats(self):
+        """工作池深度與延遲統計"""
+        with self._lock:
+            completed = self._completed
+            return {
+                'workers': self.workers,
+                'queue_size': self.queue_size,
+                'pending': self._pending,
+                'completed': completed,
+                'rejected': self._rejected,
+                'avg_wait_seconds': self._total_wait / completed if completed else 0.0,
+                'avg_run_seconds': self._total_run / completed if completed else 0.0,
+                'max_latency_seconds': self._max_latency
+            }
+
+password_pool = PasswordWorkerPool()
+
+def _bcrypt_rounds(hashed):
+    """取得 bcrypt 雜湊的工作因子，非 bcrypt 格式返回 None"""
+    if not hashed or not hashed.startswith(('$2a$', '$2b$', '$2y$')):
+        return None
+    try:
+        return int(hashed[4:6])
+    except ValueError:
+        return None
+
+_HASH_LABELS = metrics.labels(op='hash')
+_VERIFY_LABELS = metrics.labels(op='verify')
+_ENCODE_LABELS = metrics.labels(op='encode')
+_DECODE_LABELS = metrics.labels(op='decode')
+
+def _hash_password(password, rounds=None):
+    with metrics.timer('npc_bcrypt_duration_seconds', _HASH_LABELS):
+        salt = bcrypt.gensalt(rounds=rounds or BCRYPT_ROUNDS)
+        hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
+    return hashed.decode('utf-8')
+
+def _verify_password(password, hashed):
+    if _bcrypt_rounds(hashed) is None:
+        # 兼容舊的 SHA256 密碼
+        sha256_hash = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(sha256_hash, hashed or '')
+    try:
+        with metrics.timer('npc_bcrypt_duration_seconds', _VERIFY_LABELS):
+            return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+    except ValueError:
+        return False
+
+def needs_rehash(hashed):
+    """舊的 SHA256 雜湊或工作因子低於目前設定時需要重新雜湊"""
+    rounds = _bcrypt_rounds(hashed)
+    return rounds is None or rounds < BCRYPT_ROUNDS
+
+def rehash_in_background(password, save):
+    """登錄成功後在背景以目前的工作因子重新雜湊，完成後呼叫 save(new_hash)
+    
+    工作池忙碌時直接略過，下次登錄會再嘗試。
+    """
+    def rehash():
+        save(_hash_password(password))
+    return password_pool.submit_background(rehash)
+
+def calibrate_bcrypt_rounds(target_ms=50, min_rounds=10, max_rounds=16, samples=3):
+    """測量本機 bcrypt 速度，返回驗證耗時不超過 target_ms 的最高工作因子及各因子耗時（毫秒）"""
+    password = secrets.token_bytes(16)
+    timings = {}
+    chosen = min_rounds
+    for rounds in range(min_rounds, max_rounds + 1):
+        hashed = bcrypt.hashpw(password, bcrypt.gensalt(rounds=rounds))
+        durations = []
+        for _ in range(samples):
+            start = time.perf_counter()
+            bcrypt.checkpw(password, hashed)
+            durations.append((time.perf_counter() - start) * 1000)
+        timings[rounds] = sorted(durations)[len(durations) // 2]
+        if timings[rounds] > target_ms:
+            break
+        chosen = rounds
+    return chosen, timings
+
+def hash_password(password):
+    """使用 bcrypt 加密密碼（在工作池中執行）"""
+    # span 在請求執行緒中記錄，包含排隊時間
+    with tracing.span('bcrypt.hash'):
+        return password_pool.run(_hash_password, password)
+
+def verify_password(password, hashed):
+    """驗證密碼（在工作池中執行）"""
+    with tracing.span('bcrypt.verify'):
+        return password_pool.run(_verify_password, password, hashed)
+
+def generate_token(user_id, username, expiration_hours=None):
+    """生成 JWT token"""
+    exp_hours = expiration_hours if expiration_hours else JWT_EXPIRATION_HOURS
+    payload = {
+        'user_id': user_id,
+        'username': username,
+        'exp': datetime.utcnow() + timedelta(hours=exp_hours),
+        'iat': datetime.utcnow(),
+        'jti': secrets.token_urlsafe(16)
+    }
+    with metrics.timer('npc_jwt_duration_seconds', _ENCODE_LABELS, span='jwt.encode'):
+        token = jwt.encode(payload, SECRET_KEY, algorithm=JWT_ALGORITHM)
+    # PyJWT 2.x 返回字串，不需要 decode
+    if isinstance(token, bytes):
+        return token.decode('utf-8')
+    return token
+
+def generate_guest_token(guest_id, expiration_hours=24):
+    """生成訪客 JWT token（自包含，不對應資料庫中的用戶）"""
+    payload = {
+        'user_id': None,
+        'username': f'guest_{guest_id}',
+        'guest': True,
+        'exp': datetime.utcnow() + timedelta(hours=expiration_hours),
+        'iat': datetime.utcnow(),
+        'jti': secrets.token_urlsafe(16)
+    }
+    with metrics.timer('npc_jwt_duration_seconds', _ENCODE_LABELS, span='jwt.encode'):
+        token = jwt.encode(payload, SECRET_KEY, algorithm=JWT_ALGORITHM)
+    if isinstance(token, bytes):
+        return token.decode('utf-8')
+    return token
+
+class TokenCache:
+    """已驗證 token payload 的 LRU 快取，以 token 摘要為鍵"""
+    
+    def __init__(self, max_size=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode('utf-8')).digest()
+    
+    def get(self, token):
+        """返回快取中仍有效的 payload，否則返回 None"""
+        key = self._key(token)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                payload, expires_at = entry
+                if now < expires_at:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return payload
+                del self._entries[key]
+            self.misses += 1
+            return None
+    
+    def put(self, token, payload):
+        """快取已驗證的 payload，到期時間不晚於 token 的 exp"""
+        expires_at = time.time() + self.ttl
+        if 'exp' in payload:
+            expires_at = min(expires_at, payload['exp'])
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (payload, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def invalidate(self, token):
+        """移除指定 token（登出時呼叫）"""
+        with self._lock:
+            self._entries.pop(self._key(token), None)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+token_cache = TokenCache()
+
+@metrics.registry.collector
+def _collect_auth_stats():
+    """匯出 bcrypt 工作池深度與 token 快取命中率"""
+    pool = password_pool.stats()
+    cache = token_cache.stats()
+    return [
+        ('npc_bcrypt_pending', (), pool['pending']),
+        ('npc_bcrypt_capacity', (), pool['workers'] + pool['queue_size']),
+        ('npc_token_cache_requests_total', metrics.labels(result='hit'), cache['hits']),
+        ('npc_token_cache_requests_total', metrics.labels(result='miss'), cache['misses']),
+        ('npc_token_cache_entries', (), cache['size']),
+    ]
+
+def token_id(token, payload):
+    """token 的撤銷鍵：jti claim；舊版未含 jti 的 token 改用 token 摘要"""
+    return payload.get('jti') or hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+def verify_token(token):
+    """驗證 JWT token（已驗證過的 token 直接從快取返回），已撤銷的 token 返回 None"""
+    payload = token_cache.get(token)
+    if payload is None:
+        try:
+            with metrics.timer('npc_jwt_duration_seconds', _DECODE_LABELS, span='jwt.decode'):
+                payload = jwt.decode(token, SECRET_KEY, algorithms=[JWT_ALGORITHM])
+        except jwt.ExpiredSignatureError:
+            return None
+        except jwt.InvalidTokenError:
+            return None
+        token_cache.put(token, payload)
+    # 快取命中時也要檢查，其他 worker 撤銷的 token 可能仍在本進程的快取中
+    if revocation_list.is_revoked(token_id(token, payload)):
+        return None
+    return payload
+
+def revoke_token(token, payload):
+    """撤銷 token 直到其 exp 為止（登出時呼叫）"""
+    revocation_list.revoke(token_id(token, payload), int(payload['exp']))
+    token_cache.invalidate(token)
+
+def require_auth(f):
+    """認證裝飾器，保護需要登錄的路由"""
+    from functools import wraps
+    from flask import request, jsonify
+    
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        token = None
+        
+        # 從 Header 獲取 token
+        if 'Authorization' in request.headers:
+            auth_header = request.headers['Authorization']
+            try:
+                token = auth_header.split(' ')[1]  # Bearer <token>
+            except IndexError:
+                return jsonify({'message': '無效的認證格式'}), 401
+        
+        # 從 Cookie 獲取 token（備用方案）
+        if not token:
+            token = request.cookies.get('auth_token')
+        
+        if not token:
+            return jsonify({'message': '未授權，請先登錄'}), 401
+        
+        payload = verify_token(token)
+        if not payload:
+            return jsonify({'message': 'Token 無效或已過期'}), 401
+        
+        # 將用戶信息添加到請求上下文
+        request.current_user = payload
+        return f(*args, **kwargs)
+    
+    return decorated_function
+
@@ -0,0 +1,23 @@
+"""
+bcrypt 工作因子校準工具
+在目標主機上執行，依期望的驗證延遲選出 BCRYPT_ROUNDS
+
+用法：python calibrate_bcrypt.py [目標毫秒數，預設 50]
+"""
+import sys
+from auth import calibrate_bcrypt_rounds, BCRYPT_ROUNDS
+
+def main():
+    target_ms = float(sys.argv[1]) if len(sys.argv) > 1 else 50
+    rounds, timings = calibrate_bcrypt_rounds(target_ms)
+    
+    for cost, ms in timings.items():
+        print(f'rounds={cost:2d}  verify={ms:8.1f} ms')
+    
+    if timings.get(rounds, 0) > target_ms:
+        print(f'警告：最低工作因子 {rounds} 已超過目標 {target_ms} ms')
+    print(f'目前設定 BCRYPT_ROUNDS={BCRYPT_ROUNDS}')
+    print(f'建議設定：export BCRYPT_ROUNDS={rounds}')
+
+if __name__ == '__main__':
+    main()
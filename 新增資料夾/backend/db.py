@@ -0,0 +1,230 @@
+"""
+資料庫連線模組
+提供可重用的 SQLite 連線池、執行緒內連線共享與使用統計
+"""
+import sqlite3
+import threading
+import queue
+import time
+import os
+from contextlib import contextmanager
+
+# 連線池設定（可由環境變數覆寫）
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+
+# SQLite PRAGMA 設定（可由環境變數覆寫）
+JOURNAL_MODE = os.environ.get('DB_JOURNAL_MODE', 'WAL').upper()
+SYNCHRONOUS = os.environ.get('DB_SYNCHRONOUS', 'NORMAL').upper()
+CACHE_SIZE = int(os.environ.get('DB_CACHE_SIZE', -16000))  # 負值代表 KiB
+MMAP_SIZE = int(os.environ.get('DB_MMAP_SIZE', 64 * 1024 * 1024))
+BUSY_TIMEOUT = int(os.environ.get('DB_BUSY_TIMEOUT', 5000))  # 毫秒
+
+_JOURNAL_MODES = {'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'}
+_SYNCHRONOUS_MODES = {'OFF', 'NORMAL', 'FULL', 'EXTRA'}
+
+if JOURNAL_MODE not in _JOURNAL_MODES:
+    raise ValueError(f'不支援的 DB_JOURNAL_MODE: {JOURNAL_MODE}')
+if SYNCHRONOUS not in _SYNCHRONOUS_MODES:
+    raise ValueError(f'不支援的 DB_SYNCHRONOUS: {SYNCHRONOUS}')
+
+
+def apply_pragmas(conn):
+    """套用每條連線都需要的 PRAGMA 設定"""
+    conn.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT}')
+    conn.execute(f'PRAGMA synchronous = {SYNCHRONOUS}')
+    conn.execute(f'PRAGMA cache_size = {CACHE_SIZE}')
+    conn.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+
+
+def set_journal_mode(conn):
+    """設定日誌模式（WAL 會持久保存在資料庫檔案中，只需在初始化時設定一次）"""
+    row = conn.execute(f'PRAGMA journal_mode = {JOURNAL_MODE}').fetchone()
+    return row[0] if row else None
+
+
+class PoolTimeoutError(sqlite3.OperationalError):
+    """等待可用連線逾時"""
+
+
+class ConnectionPool:
+    """SQLite 連線池
+
+    同一執行緒內巢狀取用會共用同一條連線，避免重複 checkout 與死鎖。
+    閒置連線以 LIFO 方式取用，讓最近使用過（page cache 較熱）的連線優先被重用。
+    """
+
+    def __init__(self, database, size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._created = 0
+        self._in_use = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._max_wait_time = 0.0
+
+    def _connect(self):
+        """建立新連線並套用 PRAGMA 設定"""
+        conn = sqlite3.connect(self.database, timeout=BUSY_TIMEOUT / 1000, check_same_thread=False)
+        apply_pragmas(conn)
+        return conn
+
+    def acquire(self):
+        """從連線池取出一條連線"""
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._lock:
+                if self._created < self.size:
+                    self._created += 1
+                    create = True
+                else:
+                    create = False
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                # 連線池已滿，等待其他執行緒歸還
+                start = time.perf_counter()
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise PoolTimeoutError(f'等待資料庫連線逾時（{self.timeout} 秒）')
+                finally:
+                    waited = time.perf_counter() - start
+                    with self._lock:
+                        self._waits += 1
+                        self._wait_time += waited
+                        self._max_wait_time = max(self._max_wait_time, waited)
+
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+        return conn
+
+    def release(self, conn):
+        """歸還連線到連線池"""
+        if conn.in_transaction:
+            # 未提交的交易不應該帶給下一個使用者
+            conn.rollback()
+        with self._lock:
+            self._in_use -= 1
+        self._idle.put(conn)
+
+    def discard(self, conn):
+        """丟棄損壞的連線"""
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._in_use -= 1
+            self._created -= 1
+
+    @contextmanager
+    def connection(self):
+        """取得目前執行緒的連線，巢狀呼叫共用同一條連線"""
+        local = self._local
+        conn = getattr(local, 'conn', None)
+        if conn is not None:
+            local.depth += 1
+            try:
+                yield conn
+            finally:
+                local.depth -= 1
+            return
+
+        conn = self.acquire()
+        local.conn = conn
+        local.depth = 1
+        broken = False
+        try:
+            yield conn
+        except sqlite3.DatabaseError as e:
+            broken = not isinstance(e, (sqlite3.IntegrityError, sqlite3.OperationalError))
+            raise
+        finally:
+            local.conn = None
+            local.depth = 0
+            if broken:
+                self.discard(conn)
+            else:
+                self.release(conn)
+
+    def stats(self):
+        """連線池使用統計"""
+        with self._lock:
+            return {
+                'size': self.size,
+                'created': self._created,
+                'in_use': self._in_use,
+                'idle': self._idle.qsize(),
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'total_wait_seconds': self._wait_time,
+                'max_wait_seconds': self._max_wait_time,
+            }
+
+    def close_all(self):
+        """關閉所有閒置連線"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(database):
+    """取得（或建立）指定資料庫檔案的連線池"""
+    key = os.path.abspath(database)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(key)
+                _pools[key] = pool
+    return pool
+
+
+def pool_stats():
+    """所有連線池的使用統計"""
+    with _pools_lock:
+        return {path: pool.stats() for path, pool in _pools.items()}
+
+
+def close_all_pools():
+    """關閉所有連線池的閒置連線（worker 結束時呼叫）"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close_all()
+
+
+def _reset_after_fork():
+    # SQLite 連線不可跨 fork 使用；子進程直接丟棄繼承的連線池後重新建立。
+    # 不呼叫 close，避免子進程誤以為自己是最後一條連線而 checkpoint 或移除 WAL 檔
+    global _pools_lock
+    _pools.clear()
+    _pools_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
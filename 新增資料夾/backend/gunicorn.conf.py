@@ -0,0 +1,62 @@
+"""
+gunicorn 設定（gunicorn -c gunicorn.conf.py wsgi:app）
+
+- 預載應用：master 匯入 wsgi.py 時執行一次資料庫遷移，worker 以 fork 共用已載入的模組
+- gthread worker：每個 worker 多條執行緒，I/O 等待時可同時處理其他請求
+- 平滑重啟：kill -HUP 依序替換 worker；更新程式碼時用 kill -USR2 啟動新 master，
+  確認正常後對舊 master 送 WINCH（停止舊 worker）與 QUIT
+- 連線排空：SIGTERM/QUIT 後 worker 不再接受新連線，最多等待 graceful_timeout 秒完成進行中的請求
+"""
+import os
+
+_cpus = os.cpu_count() or 1
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', _cpus))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+preload_app = True
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+# 處理指定數量的請求後回收 worker（0 為停用），jitter 避免所有 worker 同時重啟
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 0))
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG') or None
+errorlog = '-'
+
+# 每個 worker 都有自己的 bcrypt 工作池，依 worker 數分配 CPU，避免整體超額訂閱
+# （設定檔在預載應用之前執行，auth.py 匯入時即會讀到）
+#
+# 不變條件：BCRYPT_WORKERS + BCRYPT_QUEUE_SIZE <= threads - 1
+# 等待 bcrypt 的請求會佔住 gthread 請求執行緒；工作池總名額必須少於請求執行緒數，
+# 登入尖峰時才會由工作池回應 503/Retry-After，並至少保留一條執行緒處理其他請求（如 /api/auth/verify）
+_bcrypt_slots = max(1, threads - 1)
+os.environ.setdefault('BCRYPT_WORKERS', str(max(1, min(_cpus // workers, _bcrypt_slots))))
+os.environ.setdefault('BCRYPT_QUEUE_SIZE', str(max(0, _bcrypt_slots - int(os.environ['BCRYPT_WORKERS']))))
+
+
+def on_starting(server):
+    """清除上次執行留下的 worker 指標快照（需設定 METRICS_DIR）"""
+    import metrics
+    metrics.clear_dir()
+
+
+def post_fork(server, worker):
+    """執行緒無法跨 fork 保留，背景工作在 worker 內啟動"""
+    from models import start_background_tasks
+    start_background_tasks()
+
+
+def post_worker_init(worker):
+    """worker 完成訊號設定後才註冊取樣分析的訊號（需設定 PROFILE_SIGNAL，請送給 worker 而非 master）"""
+    from profiler import install_signal_handler
+    install_signal_handler()
+
+
+def worker_exit(server, worker):
+    """worker 結束前寫入剩餘的登錄日誌並關閉資料庫連線"""
+    from models import stop_background_tasks
+    stop_background_tasks()
@@ -0,0 +1,48 @@
+"""
+JSON 編碼模組
+透過 Flask 的 json provider 介面使用 orjson（可選依賴，未安裝時退回標準庫 json）
+"""
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """不排序鍵、不轉義非 ASCII 字元；安裝 orjson 時直接以 bytes 建立回應"""
+
+    sort_keys = False
+    ensure_ascii = False
+
+    def _options(self, indent=False):
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def dumps(self, obj, **kwargs):
+        # 帶有標準庫專用參數（indent、separators 等）時交給預設實作
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self._options()).decode('utf-8')
+
+    def dumps_line(self, obj):
+        """編碼成單行 JSON（含換行），用於 NDJSON 串流"""
+        if orjson is None:
+            return (super().dumps(obj, separators=(',', ':')) + '\n').encode('utf-8')
+        return orjson.dumps(obj, default=self.default, option=self._options() | orjson.OPT_APPEND_NEWLINE)
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = self.compact is False or (self.compact is None and self._app.debug)
+        body = orjson.dumps(obj, default=self.default, option=self._options(indent) | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
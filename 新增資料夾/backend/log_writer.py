@@ -0,0 +1,155 @@
+"""
+登錄日誌背景寫入模組
+將登錄事件放入有界佇列，由背景執行緒以 executemany 批次提交
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+# 批次寫入設定（可由環境變數覆寫）
+LOG_QUEUE_SIZE = int(os.environ.get('LOGIN_LOG_QUEUE_SIZE', 10000))
+LOG_BATCH_SIZE = int(os.environ.get('LOGIN_LOG_BATCH_SIZE', 200))
+LOG_FLUSH_INTERVAL = float(os.environ.get('LOGIN_LOG_FLUSH_INTERVAL', 0.5))  # 秒
+# 佇列已滿時的策略：drop 丟棄新事件；block 最多等待 LOGIN_LOG_BLOCK_TIMEOUT 秒
+LOG_FULL_POLICY = os.environ.get('LOGIN_LOG_FULL_POLICY', 'drop')
+LOG_BLOCK_TIMEOUT = float(os.environ.get('LOGIN_LOG_BLOCK_TIMEOUT', 0.05))
+
+INSERT_SQL = '''
+    INSERT INTO login_logs (user_id, username, ip_address, user_agent, success, login_time)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+_STOP = object()
+
+
+class LoginLogWriter:
+    """登錄日誌的非同步批次寫入器"""
+
+    def __init__(self, get_connection, queue_size=LOG_QUEUE_SIZE, batch_size=LOG_BATCH_SIZE,
+                 flush_interval=LOG_FLUSH_INTERVAL, policy=LOG_FULL_POLICY):
+        if policy not in ('drop', 'block'):
+            raise ValueError(f'不支援的 LOGIN_LOG_FULL_POLICY: {policy}')
+        self._get_connection = get_connection
+        self._queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.policy = policy
+        self._thread = None
+        self._lock = threading.Lock()
+        self._closed = False
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.errors = 0
+        atexit.register(self.close)
+
+    def _ensure_started(self):
+        # 延遲啟動，避免在 fork 前建立執行緒
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(
+                        target=self._run, name='login-log-writer', daemon=True
+                    )
+                    self._thread.start()
+
+    def log(self, user_id, username, ip_address, user_agent, success):
+        """記錄一筆登錄事件，返回是否成功放入佇列"""
+        if self._closed:
+            return False
+        self._ensure_started()
+        # 與 CURRENT_TIMESTAMP 相同的 UTC 格式，記錄事件發生時間而不是寫入時間
+        login_time = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        event = (user_id, username, ip_address, user_agent, success, login_time)
+        try:
+            if self.policy == 'block':
+                self._queue.put(event, timeout=LOG_BLOCK_TIMEOUT)
+            else:
+                self._queue.put_nowait(event)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.enqueued += 1
+        return True
+
+    def _write(self, batch):
+        try:
+            with self._get_connection() as conn:
+                conn.executemany(INSERT_SQL, batch)
+                conn.commit()
+        except Exception:
+            with self._lock:
+                self.errors += 1
+                self.dropped += len(batch)
+            return
+        with self._lock:
+            self.written += len(batch)
+            self.batches += 1
+
+    def _run(self):
+        while True:
+            batch = []
+            stop = False
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is _STOP:
+                    stop = True
+                    break
+                if isinstance(item, threading.Event):
+                    # flush() 的標記：先寫入目前批次再通知
+                    self._write(batch)
+                    batch = []
+                    item.set()
+                else:
+                    batch.append(item)
+                    if len(batch) >= self.batch_size:
+                        break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+            if stop:
+                return
+
+    def flush(self, timeout=5.0):
+        """等待目前佇列中的事件寫入完成"""
+        if self._thread is None or not self._thread.is_alive():
+            return True
+        marker = threading.Event()
+        self._queue.put(marker)
+        return marker.wait(timeout)
+
+    def close(self, timeout=5.0):
+        """停止接受新事件並寫入所有剩餘事件（程序結束時自動呼叫）"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queued': self._queue.qsize(),
+                'enqueued': self.enqueued,
+                'written': self.written,
+                'dropped': self.dropped,
+                'batches': self.batches,
+                'errors': self.errors
+            }
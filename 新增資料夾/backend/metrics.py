@@ -0,0 +1,376 @@
+"""
+指標收集模組
+記錄請求、資料庫、bcrypt 與 JWT 的計數與延遲分佈，以 Prometheus 文字格式輸出
+
+多 worker 部署時設定 METRICS_DIR：各 worker 定期把自己的快照寫入該目錄，/metrics 彙總所有 worker。
+"""
+import functools
+import inspect
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))  # 秒
+
+_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 名稱 → (類型, 說明, histogram 的 bucket 上限)
+DEFINITIONS = {
+    'npc_http_requests_total': ('counter', 'HTTP 請求數', None),
+    'npc_http_request_duration_seconds': ('histogram', 'HTTP 請求處理時間', _LATENCY_BUCKETS),
+    'npc_http_requests_in_flight': ('gauge', '處理中的 HTTP 請求數', None),
+    'npc_db_call_duration_seconds': ('histogram', 'User 資料庫方法的執行時間', _LATENCY_BUCKETS),
+    'npc_db_call_errors_total': ('counter', 'User 資料庫方法拋出例外的次數', None),
+    'npc_bcrypt_duration_seconds': ('histogram', 'bcrypt 雜湊與驗證的執行時間', _LATENCY_BUCKETS),
+    'npc_bcrypt_queue_wait_seconds': ('histogram', 'bcrypt 工作在工作池中的排隊時間', _LATENCY_BUCKETS),
+    'npc_bcrypt_rejected_total': ('counter', 'bcrypt 工作池已滿而拒絕的請求數', None),
+    'npc_jwt_duration_seconds': ('histogram', 'JWT 編碼與解碼的執行時間', _LATENCY_BUCKETS),
+    # 以下由各子系統的 stats() 在收集時提供（見 Registry.collector）
+    'npc_db_pool_connections': ('gauge', '資料庫連線池的連線數（state=in_use 或 idle）', None),
+    'npc_db_pool_checkouts_total': ('counter', '從連線池取得連線的次數', None),
+    'npc_db_pool_waits_total': ('counter', '取得連線時需要等待的次數', None),
+    'npc_db_pool_wait_seconds_total': ('counter', '等待連線的累計秒數', None),
+    'npc_bcrypt_pending': ('gauge', 'bcrypt 工作池中執行中與排隊中的工作數', None),
+    'npc_bcrypt_capacity': ('gauge', 'bcrypt 工作池的總名額（執行緒數 + 排隊上限）', None),
+    'npc_token_cache_requests_total': ('counter', '已驗證 token 快取的查詢次數（result=hit 或 miss）', None),
+    'npc_token_cache_entries': ('gauge', '已驗證 token 快取的條目數', None),
+    'npc_login_log_queued': ('gauge', '等待寫入的登錄日誌筆數', None),
+    'npc_login_log_written_total': ('counter', '已寫入的登錄日誌筆數', None),
+    'npc_login_log_dropped_total': ('counter', '佇列已滿而丟棄的登錄日誌筆數', None),
+    'npc_login_log_errors_total': ('counter', '登錄日誌批次寫入失敗的次數', None),
+    'npc_sweeper_runs_total': ('counter', '過期資料清理的執行次數', None),
+    'npc_sweeper_deleted_total': ('counter', '清理的過期資料筆數（kind=sessions、reset_tokens 或 revocations）', None),
+    'npc_user_cache_requests_total': ('counter', '用戶資料快取的查詢次數（result=hit 或 miss）', None),
+    'npc_user_cache_invalidations_total': ('counter', '用戶資料快取的失效次數', None),
+    'npc_user_cache_entries': ('gauge', '用戶資料快取的條目數', None),
+    'npc_rate_limit_requests_total': ('counter', '登錄限速的檢查次數（limiter=ip 或 user，result=allowed 或 rejected）', None),
+}
+
+
+class Registry:
+    """進程內的指標儲存；鍵為 (名稱, 標籤 tuple)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._collectors = []
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def gauge_add(self, name, labels=(), value=1):
+        key = (name, labels)
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0) + value
+
+    def observe(self, name, seconds, labels=()):
+        buckets = DEFINITIONS[name][2]
+        key = (name, labels)
+        with self._lock:
+            entry = self._histograms.get(key)
+            if entry is None:
+                # 各 bucket 的計數（非累計）、總和、次數
+                entry = self._histograms[key] = [[0] * len(buckets), 0.0, 0]
+            for index, bound in enumerate(buckets):
+                if seconds <= bound:
+                    entry[0][index] += 1
+                    break
+            entry[1] += seconds
+            entry[2] += 1
+
+    def collector(self, func):
+        """註冊收集時呼叫的函式（可當裝飾器使用）
+
+        func() 返回 (名稱, 標籤, 數值) 的可疊代物件，依 DEFINITIONS 的類型歸入 counter 或 gauge；
+        用於匯出子系統本身已在累計的統計（stats()），不需要在熱路徑上重複計數。
+        """
+        self._collectors.append(func)
+        return func
+
+    def _collect(self):
+        counters, gauges = [], []
+        for func in self._collectors:
+            try:
+                samples = list(func())
+            except Exception:
+                continue  # 單一子系統的統計失敗不影響其他指標
+            for name, labels, value in samples:
+                target = counters if DEFINITIONS[name][0] == 'counter' else gauges
+                target.append([name, list(labels), value])
+        return counters, gauges
+
+    def snapshot(self):
+        """可 JSON 序列化的快照（含收集函式提供的數值）"""
+        collected_counters, collected_gauges = self._collect()
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'counters': [[name, list(labels), value] for (name, labels), value in self._counters.items()]
+                            + collected_counters,
+                'gauges': [[name, list(labels), value] for (name, labels), value in self._gauges.items()]
+                          + collected_gauges,
+                'histograms': [[name, list(labels), list(counts), total, count]
+                               for (name, labels), (counts, total, count) in self._histograms.items()]
+            }
+
+    def flush(self):
+        """把快照寫入 METRICS_DIR（未設定時不做事）
+
+        背景執行緒與 /metrics 都會呼叫：以鎖序列化，並寫入唯一的暫存檔後再原子替換。
+        """
+        if not METRICS_DIR:
+            return
+        path = os.path.join(METRICS_DIR, f'worker-{os.getpid()}.json')
+        with self._flush_lock:
+            f = tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=METRICS_DIR,
+                                            prefix=f'.worker-{os.getpid()}-', suffix='.tmp', delete=False)
+            try:
+                with f:
+                    json.dump(self.snapshot(), f)
+                os.replace(f.name, path)
+            except BaseException:
+                try:
+                    os.remove(f.name)
+                except OSError:
+                    pass
+                raise
+
+    def _run(self):
+        while not self._stop.wait(METRICS_FLUSH_INTERVAL):
+            try:
+                self.flush()
+            except OSError:
+                pass  # 下次再試
+
+    def start(self):
+        """啟動定期寫入快照的背景執行緒（只在設定 METRICS_DIR 時）；prefork 部署時須在 fork 之後呼叫"""
+        if not METRICS_DIR or (self._thread is not None and self._thread.is_alive()):
+            return
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='metrics-flush', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止背景執行緒並寫入最後一次快照"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(5.0)
+        self.flush()
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+
+registry = Registry()
+
+
+def labels(**values):
+    """以固定順序組成標籤 tuple（熱路徑上可預先建立並重用）"""
+    return tuple(sorted((key, str(value)) for key, value in values.items()))
+
+
+class timer:
+    """以 with 量測區塊執行時間並記錄到 histogram；指定 span 時同時記錄為追蹤 span"""
+
+    __slots__ = ('name', 'labels', 'span', 'started')
+
+    def __init__(self, name, labels=(), span=None):
+        self.name = name
+        self.labels = labels
+        self.span = span
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = time.perf_counter() - self.started
+        registry.observe(self.name, duration, self.labels)
+        if self.span is not None:
+            tracing.add_span(self.span, self.started, duration)
+
+
+def instrument_methods(exclude=()):
+    """類別裝飾器：為公開的 staticmethod 記錄執行時間與例外次數（以 method 標籤區分）
+
+    exclude 列出不存取資料庫的輔助方法，避免在逐列呼叫時增加額外成本。
+    """
+    def decorate(cls):
+        for attr, value in list(vars(cls).items()):
+            if attr.startswith('_') or attr in exclude or not isinstance(value, staticmethod):
+                continue
+            setattr(cls, attr, staticmethod(_instrument(value.__func__, f'{cls.__name__}.{attr}')))
+        return cls
+    return decorate
+
+
+def _instrument(func, method):
+    method_labels = labels(method=method)
+
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def generator_wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                yield from func(*args, **kwargs)
+            except Exception:
+                registry.inc('npc_db_call_errors_total', method_labels)
+                raise
+            finally:
+                duration = time.perf_counter() - started
+                registry.observe('npc_db_call_duration_seconds', duration, method_labels)
+                tracing.add_span(method, started, duration)
+        return generator_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            registry.inc('npc_db_call_errors_total', method_labels)
+            raise
+        finally:
+            duration = time.perf_counter() - started
+            registry.observe('npc_db_call_duration_seconds', duration, method_labels)
+            tracing.add_span(method, started, duration)
+    return wrapper
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def collect():
+    """收集所有 worker 的快照（未設定 METRICS_DIR 時只有本進程）"""
+    if not METRICS_DIR:
+        return [registry.snapshot()]
+    try:
+        registry.flush()
+    except OSError:
+        # 寫入失敗時仍以其他檔案與本進程的即時數值回應，抓取不應失敗
+        logger.exception('無法寫入指標快照')
+    try:
+        filenames = os.listdir(METRICS_DIR)
+    except OSError:
+        logger.exception('無法讀取指標目錄 %s', METRICS_DIR)
+        filenames = []
+    # 本進程一律使用即時數值，不依賴剛寫入（或寫入失敗）的檔案
+    pid = os.getpid()
+    snapshots = [registry.snapshot()]
+    for filename in filenames:
+        if not (filename.startswith('worker-') and filename.endswith('.json')):
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, filename), encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue  # 正在被替換或已刪除
+        if snapshot['pid'] == pid:
+            continue
+        # 已結束 worker 的計數仍保留（累計值），但處理中的請求數不再有意義
+        if not _pid_alive(snapshot['pid']):
+            snapshot['gauges'] = []
+        snapshots.append(snapshot)
+    return snapshots
+
+
+def clear_dir():
+    """清除舊的 worker 快照（master 啟動時呼叫）"""
+    if not METRICS_DIR:
+        return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    for filename in os.listdir(METRICS_DIR):
+        if filename.startswith(('worker-', '.worker-')):
+            os.remove(os.path.join(METRICS_DIR, filename))
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(pairs, extra=()):
+    pairs = list(pairs) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value) if value != int(value) else str(int(value))
+    return str(value)
+
+
+def render(snapshots=None):
+    """彙總快照並輸出 Prometheus 文字格式（計數與 histogram 相加，gauge 相加）"""
+    snapshots = collect() if snapshots is None else snapshots
+    scalars = {}
+    histograms = {}
+    for snapshot in snapshots:
+        for name, pairs, value in snapshot['counters'] + snapshot['gauges']:
+            key = (name, tuple(map(tuple, pairs)))
+            scalars[key] = scalars.get(key, 0) + value
+        for name, pairs, counts, total, count in snapshot['histograms']:
+            key = (name, tuple(map(tuple, pairs)))
+            entry = histograms.setdefault(key, [[0] * len(counts), 0.0, 0])
+            entry[0] = [a + b for a, b in zip(entry[0], counts)]
+            entry[1] += total
+            entry[2] += count
+
+    lines = []
+    for name, (kind, help_text, buckets) in DEFINITIONS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind == 'histogram':
+            for (metric, pairs), (counts, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f'{name}_bucket{_format_labels(pairs, [("le", repr(bound))])} {cumulative}')
+                lines.append(f'{name}_bucket{_format_labels(pairs, [("le", "+Inf")])} {count}')
+                lines.append(f'{name}_sum{_format_labels(pairs)} {_format_value(total)}')
+                lines.append(f'{name}_count{_format_labels(pairs)} {count}')
+        else:
+            for (metric, pairs), value in sorted(scalars.items()):
+                if metric == name:
+                    lines.append(f'{name}{_format_labels(pairs)} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def _reset_after_fork():
+    # 子進程不繼承 master 的數值，避免彙總時重複計算；鎖也重新建立
+    registry._lock = threading.Lock()
+    registry._thread = None
+    registry.reset()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,279 @@
+"""
+資料庫結構遷移模組
+以 schema_version 表記錄已套用的版本，啟動時只執行尚未套用的步驟
+"""
+import hashlib
+import sqlite3
+
+
+def _table_columns(cursor, table):
+    """取得資料表現有欄位名稱"""
+    cursor.execute(f'PRAGMA table_info({table})')
+    return {row[1] for row in cursor.fetchall()}
+
+
+def _initial_schema(cursor):
+    """版本 1：基礎資料表（相容於舊版以 ALTER TABLE 補欄位的資料庫）"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            email TEXT,
+            reset_token TEXT,
+            reset_token_expires TIMESTAMP,
+            failed_login_attempts INTEGER DEFAULT 0,
+            locked_until TIMESTAMP,
+            last_login TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # 舊資料庫可能缺少後來加入的欄位
+    legacy_columns = [
+        ('reset_token', 'TEXT'),
+        ('reset_token_expires', 'TIMESTAMP'),
+        ('email', 'TEXT'),
+        ('failed_login_attempts', 'INTEGER DEFAULT 0'),
+        ('locked_until', 'TIMESTAMP'),
+        ('last_login', 'TIMESTAMP')
+    ]
+    existing = _table_columns(cursor, 'users')
+    for column_name, column_type in legacy_columns:
+        if column_name not in existing:
+            cursor.execute(f'ALTER TABLE users ADD COLUMN {column_name} {column_type}')
+
+    # 登錄日誌表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS login_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            username TEXT,
+            ip_address TEXT,
+            user_agent TEXT,
+            success BOOLEAN,
+            login_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    ''')
+
+    # Session 表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            token TEXT UNIQUE NOT NULL,
+            ip_address TEXT,
+            user_agent TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    ''')
+
+
+def _lookup_indexes(cursor):
+    """版本 2：為各查詢路徑建立次要索引"""
+    # email 與 reset_token 大多為 NULL，使用部分索引縮小體積
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_users_email
+        ON users(email) WHERE email IS NOT NULL
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_users_reset_token
+        ON users(reset_token) WHERE reset_token IS NOT NULL
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_sessions_user_expires
+        ON sessions(user_id, expires_at)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_login_logs_username_time
+        ON login_logs(username, login_time)
+    ''')
+    cursor.execute('ANALYZE')
+
+
+def _expiry_indexes(cursor):
+    """版本 3：過期資料清理所需的索引"""
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_sessions_expires
+        ON sessions(expires_at)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_users_reset_token_expires
+        ON users(reset_token_expires) WHERE reset_token IS NOT NULL
+    ''')
+
+
+def _revoked_tokens(cursor):
+    """版本 4：已撤銷 token 清單（expires_at 為 token 的 exp，Unix 秒數）"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS revoked_tokens (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            jti TEXT UNIQUE NOT NULL,
+            expires_at INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_revoked_tokens_expires
+        ON revoked_tokens(expires_at)
+    ''')
+
+
+def session_key(token):
+    """Session 的索引鍵：token 的 SHA-256 摘要前 16 位元組（固定長度，取代完整 JWT 字串）"""
+    return hashlib.sha256(token.encode('utf-8')).digest()[:16]
+
+
+def _compact_session_keys(cursor):
+    """版本 5：sessions 改以 16 位元組摘要為唯一鍵，不再保存完整 token"""
+    cursor.connection.create_function('session_key', 1, session_key, deterministic=True)
+    cursor.execute('''
+        CREATE TABLE sessions_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            token_hash BLOB UNIQUE NOT NULL,
+            ip_address TEXT,
+            user_agent TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    ''')
+    cursor.execute('''
+        INSERT OR IGNORE INTO sessions_new (id, user_id, token_hash, ip_address, user_agent, created_at, expires_at)
+        SELECT id, user_id, session_key(token), ip_address, user_agent, created_at, expires_at FROM sessions
+    ''')
+    cursor.execute('DROP TABLE sessions')
+    cursor.execute('ALTER TABLE sessions_new RENAME TO sessions')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_sessions_user_expires
+        ON sessions(user_id, expires_at)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_sessions_expires
+        ON sessions(expires_at)
+    ''')
+
+
+def _version_counters(cursor):
+    """版本 6：ETag 用的版本號
+
+    users.version 在公開欄位變更時遞增；table_versions 記錄用戶列表的版本。
+    以觸發器在同一個交易內維護，所有寫入路徑（含背景清理與其他 worker）都會更新。
+    """
+    if 'version' not in _table_columns(cursor, 'users'):
+        cursor.execute('ALTER TABLE users ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS table_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO table_versions (name, version) VALUES ('users', 0)")
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS users_profile_version
+        AFTER UPDATE OF username, email, last_login ON users
+        BEGIN
+            UPDATE users SET version = version + 1 WHERE id = NEW.id;
+        END
+    ''')
+    # 列表只包含 id、username、email、created_at，登錄等其他欄位的更新不影響列表版本
+    for name, event in (('insert', 'INSERT'), ('delete', 'DELETE'), ('update', 'UPDATE OF username, email')):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS users_list_version_{name}
+            AFTER {event} ON users
+            BEGIN
+                UPDATE table_versions SET version = version + 1 WHERE name = 'users';
+            END
+        ''')
+
+
+def _profile_version(cursor):
+    """用戶公開資料的全域版本號，供各 worker 的用戶資料快取判斷是否需要逐筆驗證
+
+    只在公開欄位（username、email、last_login）更新或刪除用戶時遞增；
+    登錄日誌、Session 等其他表的寫入不影響。
+    """
+    cursor.execute("INSERT OR IGNORE INTO table_versions (name, version) VALUES ('user_profiles', 0)")
+    for name, event in (('update', 'UPDATE OF username, email, last_login'), ('delete', 'DELETE')):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS users_profiles_version_{name}
+            AFTER {event} ON users
+            BEGIN
+                UPDATE table_versions SET version = version + 1 WHERE name = 'user_profiles';
+            END
+        ''')
+
+
+# (版本, 說明, 套用函式)，版本號必須遞增且不可修改已發佈的步驟
+MIGRATIONS = [
+    (1, '基礎資料表', _initial_schema),
+    (2, '查詢路徑索引', _lookup_indexes),
+    (3, '過期資料清理索引', _expiry_indexes),
+    (4, 'token 撤銷清單', _revoked_tokens),
+    (5, 'Session 以摘要為鍵', _compact_session_keys),
+    (6, 'ETag 版本號', _version_counters),
+    (7, '用戶公開資料版本號', _profile_version),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    """取得資料庫目前的結構版本"""
+    try:
+        row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    except sqlite3.OperationalError:
+        return 0  # 尚未建立 schema_version 表
+    return row[0] or 0
+
+
+def migrate(conn):
+    """套用所有尚未執行的遷移步驟，返回實際套用的版本列表"""
+    if current_version(conn) >= LATEST_VERSION:
+        return []
+
+    applied = []
+    # BEGIN IMMEDIATE 取得寫鎖，避免多個行程同時遷移
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        version = current_version(conn)
+        for step_version, description, apply in MIGRATIONS:
+            if step_version <= version:
+                continue
+            apply(cursor)
+            cursor.execute(
+                'INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                (step_version, description)
+            )
+            applied.append(step_version)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return applied
+
+
+def find_full_scans(conn, queries):
+    """以 EXPLAIN QUERY PLAN 檢查 (名稱, SQL, 參數) 列表，返回會全表掃描的 (名稱, 計畫) 列表
+
+    queries 通常為 models.INDEXED_QUERIES（由實際執行的 SQL 常數組成）。
+    """
+    offenders = []
+    for name, sql, params in queries:
+        plan = conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+        for row in plan:
+            detail = row[-1]
+            if detail.startswith('SCAN'):
+                offenders.append((name, detail))
+    return offenders
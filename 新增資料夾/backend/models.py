@@ -1,354 +1,547 @@
-import sqlite3
-import os
-from datetime import datetime
-
-DATABASE_PATH = os.path.join(os.path.dirname(__file__), '..', 'database', 'users.db')
-
-class User:
-    def __init__(self, id, username, password, email=None, reset_token=None, reset_token_expires=None, 
-                 failed_login_attempts=0, locked_until=None, last_login=None, created_at=None):
-        self.id = id
-        self.username = username
-        self.password = password
-        self.email = email
-        self.reset_token = reset_token
-        self.reset_token_expires = reset_token_expires
-        self.failed_login_attempts = failed_login_attempts or 0
-        self.locked_until = locked_until
-        self.last_login = last_login
-        self.created_at = created_at
-    
-    @staticmethod
-    def init_db():
-        """初始化資料庫"""
-        os.makedirs(os.path.dirname(DATABASE_PATH), exist_ok=True)
-        
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password TEXT NOT NULL,
-                email TEXT,
-                reset_token TEXT,
-                reset_token_expires TIMESTAMP,
-                failed_login_attempts INTEGER DEFAULT 0,
-                locked_until TIMESTAMP,
-                last_login TIMESTAMP,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # 為現有表添加新欄位（如果不存在）
-        columns_to_add = [
-            ('reset_token', 'TEXT'),
-            ('reset_token_expires', 'TIMESTAMP'),
-            ('email', 'TEXT'),
-            ('failed_login_attempts', 'INTEGER DEFAULT 0'),
-            ('locked_until', 'TIMESTAMP'),
-            ('last_login', 'TIMESTAMP')
-        ]
-        
-        for column_name, column_type in columns_to_add:
-            try:
-                cursor.execute(f'ALTER TABLE users ADD COLUMN {column_name} {column_type}')
-            except sqlite3.OperationalError:
-                pass  # 欄位已存在
-        
-        # 創建登錄日誌表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS login_logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                username TEXT,
-                ip_address TEXT,
-                user_agent TEXT,
-                success BOOLEAN,
-                login_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(id)
-            )
-        ''')
-        
-        # 創建 Session 表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS sessions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                token TEXT UNIQUE NOT NULL,
-                ip_address TEXT,
-                user_agent TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                expires_at TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(id)
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
-    
-    @staticmethod
-    def create(username, password, email=None):
-        """創建新用戶"""
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            'INSERT INTO users (username, password, email) VALUES (?, ?, ?)',
-            (username, password, email)
-        )
-        
-        conn.commit()
-        user_id = cursor.lastrowid
-        conn.close()
-        
-        return User(user_id, username, password, email)
-    
-    @staticmethod
-    def get_by_username(username):
-        """根據用戶名獲取用戶"""
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, username, password, email, reset_token, reset_token_expires, 
-                   failed_login_attempts, locked_until, last_login, created_at 
-            FROM users WHERE username = ?
-        ''', (username,))
-        row = cursor.fetchone()
-        conn.close()
-        
-        if row:
-            return User(row[0], row[1], row[2], row[3], row[4], row[5], row[6], row[7], row[8], row[9])
-        return None
-    
-    @staticmethod
-    def get_by_email(email):
-        """根據電子郵件獲取用戶"""
-        if not email:
-            return None
-            
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, username, password, email, reset_token, reset_token_expires, 
-                   failed_login_attempts, locked_until, last_login, created_at 
-            FROM users WHERE email = ?
-        ''', (email,))
-        row = cursor.fetchone()
-        conn.close()
-        
-        if row:
-            return User(row[0], row[1], row[2], row[3], row[4], row[5], row[6], row[7], row[8], row[9])
-        return None
-    
-    @staticmethod
-    def get_by_id(user_id):
-        """根據 ID 獲取用戶"""
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, username, password, email, reset_token, reset_token_expires, 
-                   failed_login_attempts, locked_until, last_login, created_at 
-            FROM users WHERE id = ?
-        ''', (user_id,))
-        row = cursor.fetchone()
-        conn.close()
-        
-        if row:
-            return User(row[0], row[1], row[2], row[3], row[4], row[5], row[6], row[7], row[8], row[9])
-        return None
-    
-    @staticmethod
-    def update_password(username, new_password):
-        """更新用戶密碼"""
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            'UPDATE users SET password = ?, reset_token = NULL, reset_token_expires = NULL, failed_login_attempts = 0, locked_until = NULL WHERE username = ?',
-            (new_password, username)
-        )
-        
-        conn.commit()
-        conn.close()
-    
-    @staticmethod
-    def record_login_success(username, ip_address=None, user_agent=None):
-        """記錄登錄成功"""
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        user = User.get_by_username(username)
-        if user:
-            # 更新最後登錄時間和重置失敗次數
-            cursor.execute(
-                'UPDATE users SET last_login = ?, failed_login_attempts = 0, locked_until = NULL WHERE username = ?',
-                (datetime.now().isoformat(), username)
-            )
-            
-            # 記錄登錄日誌
-            cursor.execute(
-                'INSERT INTO login_logs (user_id, username, ip_address, user_agent, success) VALUES (?, ?, ?, ?, ?)',
-                (user.id, username, ip_address, user_agent, True)
-            )
-        
-        conn.commit()
-        conn.close()
-    
-    @staticmethod
-    def record_login_failure(username, ip_address=None, user_agent=None):
-        """記錄登錄失敗"""
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        user = User.get_by_username(username)
-        if user:
-            # 增加失敗次數
-            failed_attempts = (user.failed_login_attempts or 0) + 1
-            locked_until = None
-            
-            # 如果失敗5次以上，鎖定帳號30分鐘
-            if failed_attempts >= 5:
-                from datetime import timedelta
-                locked_until = (datetime.now() + timedelta(minutes=30)).isoformat()
-            
-            cursor.execute(
-                'UPDATE users SET failed_login_attempts = ?, locked_until = ? WHERE username = ?',
-                (failed_attempts, locked_until, username)
-            )
-            
-            # 記錄登錄日誌
-            cursor.execute(
-                'INSERT INTO login_logs (user_id, username, ip_address, user_agent, success) VALUES (?, ?, ?, ?, ?)',
-                (user.id, username, ip_address, user_agent, False)
-            )
-        
-        conn.commit()
-        conn.close()
-    
-    @staticmethod
-    def is_locked(username):
-        """檢查帳號是否被鎖定"""
-        user = User.get_by_username(username)
-        if not user or not user.locked_until:
-            return False
-        
-        try:
-            locked_until = datetime.fromisoformat(user.locked_until.replace('Z', '+00:00'))
-            if datetime.now() < locked_until:
-                return True
-            else:
-                # 解鎖帳號
-                conn = sqlite3.connect(DATABASE_PATH)
-                cursor = conn.cursor()
-                cursor.execute(
-                    'UPDATE users SET locked_until = NULL, failed_login_attempts = 0 WHERE username = ?',
-                    (username,)
-                )
-                conn.commit()
-                conn.close()
-                return False
-        except:
-            return False
-    
-    @staticmethod
-    def set_reset_token(username, token, expires_at):
-        """設置密碼重置 token"""
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        # 將 datetime 轉換為字串格式存儲
-        expires_str = expires_at.isoformat() if hasattr(expires_at, 'isoformat') else str(expires_at)
-        cursor.execute(
-            'UPDATE users SET reset_token = ?, reset_token_expires = ? WHERE username = ?',
-            (token, expires_str, username)
-        )
-        
-        conn.commit()
-        conn.close()
-    
-    @staticmethod
-    def get_by_reset_token(token):
-        """根據重置 token 獲取用戶"""
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            'SELECT id, username, password, reset_token, reset_token_expires FROM users WHERE reset_token = ?',
-            (token,)
-        )
-        row = cursor.fetchone()
-        conn.close()
-        
-        if row:
-            return User(row[0], row[1], row[2], row[3], row[4])
-        return None
-    
-    @staticmethod
-    def get_all():
-        """獲取所有用戶"""
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, username, password, email, reset_token, reset_token_expires, 
-                   failed_login_attempts, locked_until, last_login, created_at 
-            FROM users
-        ''')
-        rows = cursor.fetchall()
-        conn.close()
-        
-        return [User(row[0], row[1], row[2], row[3], row[4], row[5], row[6], row[7], row[8], row[9]) for row in rows]
-    
-    @staticmethod
-    def save_session(user_id, token, ip_address=None, user_agent=None, expires_at=None):
-        """保存 Session"""
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            'INSERT INTO sessions (user_id, token, ip_address, user_agent, expires_at) VALUES (?, ?, ?, ?, ?)',
-            (user_id, token, ip_address, user_agent, expires_at)
-        )
-        
-        conn.commit()
-        conn.close()
-    
-    @staticmethod
-    def delete_session(token):
-        """刪除 Session"""
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute('DELETE FROM sessions WHERE token = ?', (token,))
-        
-        conn.commit()
-        conn.close()
-    
-    @staticmethod
-    def get_session_by_token(token):
-        """根據 token 獲取 Session"""
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT user_id, token, expires_at FROM sessions WHERE token = ?', (token,))
-        row = cursor.fetchone()
-        conn.close()
-        
-        if row:
-            # 檢查是否過期
-            if row[2]:
-                try:
-                    expires_at = datetime.fromisoformat(row[2].replace('Z', '+00:00'))
-                    if datetime.now() > expires_at:
-                        User.delete_session(token)
-                        return None
-                except:
-                    pass
-            return {'user_id': row[0], 'token': row[1]}
-        return None
-
+import os
+from datetime import datetime, timedelta
+from db import get_pool, set_journal_mode, close_all_pools, pool_stats
+from migrations import migrate, session_key
+from log_writer import LoginLogWriter, INSERT_SQL as _INSERT_LOGIN_LOG_SQL
+from sweeper import ExpirySweeper, INDEXED_QUERIES as _SWEEPER_QUERIES
+from user_cache import UserCache, PROFILES_VERSION_SQL, USER_VERSION_SQL
+from revocation import RevocationList, INDEXED_QUERIES as _REVOCATION_QUERIES
+import metrics
+
+DATABASE_PATH = os.environ.get(
+    'DATABASE_PATH', os.path.join(os.path.dirname(__file__), '..', 'database', 'users.db')
+)
+
+# 帳號鎖定策略：失敗5次以上，鎖定帳號30分鐘
+MAX_FAILED_ATTEMPTS = 5
+LOCKOUT_MINUTES = 30
+
+# 登錄結果
+LOGIN_OK = 'ok'
+LOGIN_INVALID = 'invalid'
+LOGIN_LOCKED = 'locked'
+
+# 以單一 UPDATE 原子地累加失敗次數（鎖定已過期時重新計算），避免讀取-修改-寫入競爭
+_RECORD_FAILURE_SQL = '''
+    UPDATE users SET
+        failed_login_attempts = CASE
+            WHEN locked_until IS NOT NULL AND locked_until <= :now THEN 1
+            ELSE COALESCE(failed_login_attempts, 0) + 1
+        END,
+        locked_until = CASE
+            WHEN locked_until IS NOT NULL AND locked_until > :now THEN locked_until
+            WHEN (CASE
+                    WHEN locked_until IS NOT NULL AND locked_until <= :now THEN 1
+                    ELSE COALESCE(failed_login_attempts, 0) + 1
+                  END) >= :max_attempts THEN :lock_until
+            ELSE NULL
+        END
+    WHERE id = :user_id
+'''
+
+
+def get_connection():
+    """從連線池取得目前執行緒共用的資料庫連線"""
+    return get_pool(DATABASE_PATH).connection()
+
+
+# 登錄日誌在背景批次寫入，不佔用請求的寫入交易
+login_log_writer = LoginLogWriter(get_connection)
+
+# 定期清理過期 Session 與密碼重置 token
+expiry_sweeper = ExpirySweeper(get_connection)
+
+# 用戶公開資料的讀取快取，寫入用戶資料時失效
+user_cache = UserCache()
+
+# 已登出 token 的撤銷清單，驗證 token 時在記憶體中查詢
+revocation_list = RevocationList(get_connection)
+
+
+@metrics.registry.collector
+def _collect_storage_stats():
+    """匯出連線池、登錄日誌寫入器、過期清理與用戶快取的統計"""
+    samples = []
+    pools = pool_stats().values()
+    samples += [
+        ('npc_db_pool_connections', metrics.labels(state='in_use'), sum(p['in_use'] for p in pools)),
+        ('npc_db_pool_connections', metrics.labels(state='idle'), sum(p['idle'] for p in pools)),
+        ('npc_db_pool_checkouts_total', (), sum(p['checkouts'] for p in pools)),
+        ('npc_db_pool_waits_total', (), sum(p['waits'] for p in pools)),
+        ('npc_db_pool_wait_seconds_total', (), sum(p['total_wait_seconds'] for p in pools)),
+    ]
+    log = login_log_writer.stats()
+    samples += [
+        ('npc_login_log_queued', (), log['queued']),
+        ('npc_login_log_written_total', (), log['written']),
+        ('npc_login_log_dropped_total', (), log['dropped']),
+        ('npc_login_log_errors_total', (), log['errors']),
+    ]
+    sweep = expiry_sweeper.stats()
+    samples += [
+        ('npc_sweeper_runs_total', (), sweep['runs']),
+        ('npc_sweeper_deleted_total', metrics.labels(kind='sessions'), sweep['total_sessions']),
+        ('npc_sweeper_deleted_total', metrics.labels(kind='reset_tokens'), sweep['total_reset_tokens']),
+        ('npc_sweeper_deleted_total', metrics.labels(kind='revocations'), sweep['total_revocations']),
+    ]
+    cache = user_cache.stats()
+    samples += [
+        ('npc_user_cache_requests_total', metrics.labels(result='hit'), cache['hits']),
+        ('npc_user_cache_requests_total', metrics.labels(result='miss'), cache['misses']),
+        ('npc_user_cache_invalidations_total', (), cache['invalidations']),
+        ('npc_user_cache_entries', (), cache['size']),
+    ]
+    return samples
+
+
+def init_db():
+    """初始化資料庫：設定日誌模式並套用尚未執行的結構遷移"""
+    os.makedirs(os.path.dirname(DATABASE_PATH), exist_ok=True)
+    
+    with get_connection() as conn:
+        set_journal_mode(conn)
+        return migrate(conn)
+
+
+def start_background_tasks():
+    """啟動背景工作（過期資料清理、撤銷清單同步、指標快照）；prefork 部署時須在 fork 之後於各 worker 呼叫"""
+    expiry_sweeper.start()
+    revocation_list.start()
+    metrics.registry.start()
+
+
+def stop_background_tasks():
+    """停止背景工作、寫入剩餘的登錄日誌並關閉資料庫連線（worker 結束時呼叫）"""
+    expiry_sweeper.stop()
+    revocation_list.stop()
+    login_log_writer.close()
+    close_all_pools()
+    metrics.registry.stop()
+
+
+# users 表的全部欄位（順序與 User.__init__ 參數一致）
+USER_COLUMNS = ('id', 'username', 'password', 'email', 'reset_token', 'reset_token_expires',
+                'failed_login_attempts', 'locked_until', 'last_login', 'created_at', 'version')
+
+# 常用的欄位投影（version 用於產生 ETag，不會輸出）
+PUBLIC_COLUMNS = ('id', 'username', 'email', 'last_login', 'created_at', 'version')
+LOGIN_COLUMNS = ('id', 'username', 'password', 'email', 'locked_until', 'last_login')
+RESET_COLUMNS = ('id', 'username', 'password', 'reset_token', 'reset_token_expires')
+EXISTS_COLUMNS = ('id',)
+
+# 用戶列表的欄位（同時是 SELECT 順序與回應的鍵）
+LIST_COLUMNS = ('id', 'username', 'email', 'created_at')
+_LIST_SELECT = ', '.join(LIST_COLUMNS)
+
+# User 方法執行的 SQL；新增或修改語句時請一併更新下方的 INDEXED_QUERIES
+_FETCH_SQL = 'SELECT {select} FROM users WHERE {where}'
+_BY_USERNAME = 'username = ?'
+_BY_EMAIL = 'email = ?'
+_BY_ID = 'id = ?'
+_BY_RESET_TOKEN = 'reset_token = ?'
+_INSERT_USER_SQL = 'INSERT INTO users (username, password, email) VALUES (?, ?, ?)'
+_UPDATE_PASSWORD_SQL = (
+    'UPDATE users SET password = ?, reset_token = NULL, reset_token_expires = NULL, '
+    'failed_login_attempts = 0, locked_until = NULL WHERE username = ?'
+)
+_REPLACE_HASH_SQL = 'UPDATE users SET password = ? WHERE id = ? AND password = ?'
+_RECORD_SUCCESS_SQL = 'UPDATE users SET last_login = ?, failed_login_attempts = 0, locked_until = NULL WHERE username = ?'
+# 讀取之後若被其他請求鎖定，則不允許登錄
+_OPEN_LOGIN_SQL = (
+    'UPDATE users SET last_login = ?, failed_login_attempts = 0, locked_until = NULL '
+    'WHERE id = ? AND (locked_until IS NULL OR locked_until <= ?)'
+)
+_UNLOCK_SQL = 'UPDATE users SET locked_until = NULL, failed_login_attempts = 0 WHERE username = ?'
+_SET_RESET_TOKEN_SQL = 'UPDATE users SET reset_token = ?, reset_token_expires = ? WHERE username = ?'
+_LIST_VERSION_SQL = "SELECT version FROM table_versions WHERE name = 'users'"
+_PAGE_SQL = f'SELECT {_LIST_SELECT} FROM users WHERE id > ? ORDER BY id LIMIT ?'
+_ITER_SQL = f'SELECT {_LIST_SELECT} FROM users WHERE id > ? ORDER BY id'
+_INSERT_SESSION_SQL = (
+    'INSERT INTO sessions (user_id, token_hash, ip_address, user_agent, expires_at) VALUES (?, ?, ?, ?, ?)'
+)
+_DELETE_SESSION_SQL = 'DELETE FROM sessions WHERE token_hash = ?'
+_SESSION_SQL = 'SELECT user_id, expires_at FROM sessions WHERE token_hash = ?'
+
+# 必須走索引的語句（名稱, SQL, 範例參數），測試中以 migrations.find_full_scans 檢查；
+# get_all 刻意讀取整個 users 表，不列入
+INDEXED_QUERIES = [
+    ('User.get_by_username', _FETCH_SQL.format(select='id', where=_BY_USERNAME), ('',)),
+    ('User.get_by_email', _FETCH_SQL.format(select='id', where=_BY_EMAIL), ('',)),
+    ('User.get_by_id', _FETCH_SQL.format(select='id', where=_BY_ID), (0,)),
+    ('User.get_by_reset_token', _FETCH_SQL.format(select='id', where=_BY_RESET_TOKEN), ('',)),
+    ('User.create', _INSERT_USER_SQL, ('', '', '')),
+    ('User.update_password', _UPDATE_PASSWORD_SQL, ('', '')),
+    ('User.replace_password_hash', _REPLACE_HASH_SQL, ('', 0, '')),
+    ('User.record_login_success', _RECORD_SUCCESS_SQL, ('', '')),
+    ('User.record_login_failure', _RECORD_FAILURE_SQL,
+     {'now': '', 'max_attempts': MAX_FAILED_ATTEMPTS, 'lock_until': '', 'user_id': 0}),
+    ('User.authenticate_and_open_session', _OPEN_LOGIN_SQL, ('', 0, '')),
+    ('User.is_locked', _UNLOCK_SQL, ('',)),
+    ('User.set_reset_token', _SET_RESET_TOKEN_SQL, ('', '', '')),
+    ('User.list_version', _LIST_VERSION_SQL, ()),
+    ('User.get_page', _PAGE_SQL, (0, 1)),
+    ('User.iter_public', _ITER_SQL, (0,)),
+    ('User.save_session', _INSERT_SESSION_SQL, (0, b'', '', '', '')),
+    ('User.delete_session', _DELETE_SESSION_SQL, (b'',)),
+    ('User.get_session_by_token', _SESSION_SQL, (b'',)),
+    ('LoginLogWriter', _INSERT_LOGIN_LOG_SQL, (0, '', '', '', True, '')),
+    ('UserCache.profiles_version', PROFILES_VERSION_SQL, ()),
+    ('UserCache.user_version', USER_VERSION_SQL, (0,)),
+] + _SWEEPER_QUERIES + _REVOCATION_QUERIES
+
+
+def _select_columns(columns):
+    """驗證並組合 SELECT 欄位清單（欄位名稱只能來自 USER_COLUMNS，未列出 id 時自動補上）"""
+    columns = tuple(columns) if columns else USER_COLUMNS
+    if 'id' not in columns:
+        # User 的建構子必須有 id
+        columns = ('id',) + columns
+    unknown = set(columns) - set(USER_COLUMNS)
+    if unknown:
+        raise ValueError(f'未知的欄位: {", ".join(sorted(unknown))}')
+    return columns, ', '.join(columns)
+
+
+@metrics.instrument_methods(exclude=('from_row', 'list_row_to_dict'))
+class User:
+    # 使用 __slots__ 省去每個實例的 __dict__
+    __slots__ = USER_COLUMNS
+    
+    def __init__(self, id, username=None, password=None, email=None, reset_token=None, reset_token_expires=None, 
+                 failed_login_attempts=0, locked_until=None, last_login=None, created_at=None, version=0):
+        self.id = id
+        self.username = username
+        self.password = password
+        self.email = email
+        self.reset_token = reset_token
+        self.reset_token_expires = reset_token_expires
+        self.failed_login_attempts = failed_login_attempts or 0
+        self.locked_until = locked_until
+        self.last_login = last_login
+        self.created_at = created_at
+        self.version = version or 0
+    
+    @staticmethod
+    def from_row(columns, row):
+        """由查詢結果建立 User，未查詢的欄位保持預設值"""
+        return User(**dict(zip(columns, row)))
+    
+    def to_public_dict(self):
+        """公開資料（PUBLIC_COLUMNS），用於 /api/auth/verify 與 /api/user/profile"""
+        return {
+            'id': self.id,
+            'username': self.username,
+            'email': self.email,
+            'last_login': self.last_login,
+            'created_at': self.created_at
+        }
+    
+    @property
+    def etag(self):
+        """公開資料的 ETag，公開欄位變更時由觸發器遞增 version"""
+        return f'user-{self.id}-{self.version}'
+    
+    @staticmethod
+    def list_row_to_dict(row):
+        """將 LIST_COLUMNS 順序的查詢結果轉為列表項目，不建立 User 實例"""
+        return dict(zip(LIST_COLUMNS, row))
+    
+    @staticmethod
+    def _fetch_one(where, params, columns=None):
+        """依條件查詢單一用戶，只讀取 columns 指定的欄位"""
+        columns, select = _select_columns(columns)
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(_FETCH_SQL.format(select=select, where=where), params)
+            row = cursor.fetchone()
+        
+        if row:
+            return User.from_row(columns, row)
+        return None
+    
+    @staticmethod
+    def init_db():
+        """初始化資料庫"""
+        return init_db()
+    
+    @staticmethod
+    def create(username, password, email=None):
+        """創建新用戶"""
+        with get_connection() as conn:
+            cursor = conn.cursor()
+        
+            cursor.execute(_INSERT_USER_SQL, (username, password, email))
+        
+            conn.commit()
+            user_id = cursor.lastrowid
+        
+        user_cache.invalidate(user_id, username)
+        return User(user_id, username, password, email)
+    
+    @staticmethod
+    def get_by_username(username, columns=None):
+        """根據用戶名獲取用戶"""
+        return User._fetch_one(_BY_USERNAME, (username,), columns)
+    
+    @staticmethod
+    def get_by_email(email, columns=None):
+        """根據電子郵件獲取用戶"""
+        if not email:
+            return None
+        return User._fetch_one(_BY_EMAIL, (email,), columns)
+    
+    @staticmethod
+    def get_by_id(user_id, columns=None):
+        """根據 ID 獲取用戶"""
+        return User._fetch_one(_BY_ID, (user_id,), columns)
+    
+    @staticmethod
+    def get_profile(user_id):
+        """獲取用戶公開資料（讀取快取，未命中時查詢資料庫）"""
+        if not user_cache.enabled:
+            return User.get_by_id(user_id, PUBLIC_COLUMNS)
+        
+        with get_connection() as conn:
+            version = user_cache.profiles_version(conn)
+            user = user_cache.get(user_id, conn, version)
+            if user is None:
+                generation = user_cache.generation()
+                user = User.get_by_id(user_id, PUBLIC_COLUMNS)
+                if user:
+                    user_cache.put(user, generation, version)
+        return user
+    
+    @staticmethod
+    def update_password(username, new_password):
+        """更新用戶密碼"""
+        with get_connection() as conn:
+            cursor = conn.cursor()
+        
+            cursor.execute(_UPDATE_PASSWORD_SQL, (new_password, username))
+        
+            conn.commit()
+        
+        user_cache.invalidate(username=username)
+    
+    @staticmethod
+    def replace_password_hash(user_id, old_hash, new_hash):
+        """以新雜湊取代舊雜湊（密碼在此期間被修改時不覆寫），返回是否成功"""
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(_REPLACE_HASH_SQL, (new_hash, user_id, old_hash))
+            conn.commit()
+            return cursor.rowcount > 0
+    
+    @staticmethod
+    def record_login_success(username, ip_address=None, user_agent=None):
+        """記錄登錄成功"""
+        with get_connection() as conn:
+            cursor = conn.cursor()
+        
+            user = User.get_by_username(username, EXISTS_COLUMNS)
+            if user:
+                # 更新最後登錄時間和重置失敗次數
+                cursor.execute(_RECORD_SUCCESS_SQL, (datetime.now().isoformat(), username))
+        
+            conn.commit()
+        
+        if user:
+            # 提交成功後才記錄登錄日誌，避免交易失敗時留下不實的紀錄
+            login_log_writer.log(user.id, username, ip_address, user_agent, True)
+            user_cache.invalidate(user.id)
+    
+    @staticmethod
+    def record_login_failure(username, ip_address=None, user_agent=None):
+        """記錄登錄失敗"""
+        with get_connection() as conn:
+            cursor = conn.cursor()
+        
+            user = User.get_by_username(username, EXISTS_COLUMNS)
+            if user:
+                # 增加失敗次數，達到上限時鎖定帳號
+                User._apply_login_failure(cursor, user.id)
+        
+            conn.commit()
+        
+        if user:
+            login_log_writer.log(user.id, username, ip_address, user_agent, False)
+    
+    @staticmethod
+    def _apply_login_failure(cursor, user_id):
+        """原子地累加失敗次數並視需要鎖定帳號"""
+        now = datetime.now()
+        cursor.execute(_RECORD_FAILURE_SQL, {
+            'now': now.isoformat(),
+            'max_attempts': MAX_FAILED_ATTEMPTS,
+            'lock_until': (now + timedelta(minutes=LOCKOUT_MINUTES)).isoformat(),
+            'user_id': user_id
+        })
+    
+    @staticmethod
+    def authenticate_and_open_session(username, check_password, issue_token, ip_address=None, user_agent=None):
+        """登錄的完整工作單元：一次讀取、一次提交
+        
+        check_password(hashed) 驗證密碼並返回 bool；issue_token(user) 返回 (token, expires_at)。
+        返回 (狀態, user, token)，狀態為 LOGIN_OK、LOGIN_INVALID 或 LOGIN_LOCKED。
+        """
+        user = User.get_by_username(username, LOGIN_COLUMNS)
+        if not user:
+            return LOGIN_INVALID, None, None
+        
+        now = datetime.now().isoformat()
+        if user.locked_until and user.locked_until > now:
+            return LOGIN_LOCKED, user, None
+        
+        # bcrypt 很慢，在取得寫鎖之前完成驗證
+        password_ok = check_password(user.password)
+        
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if not password_ok:
+                    User._apply_login_failure(cursor, user.id)
+                    conn.commit()
+                    # 登錄日誌只在交易提交成功後排入佇列
+                    login_log_writer.log(user.id, username, ip_address, user_agent, False)
+                    return LOGIN_INVALID, user, None
+                
+                # 讀取之後若被其他請求鎖定，則不允許登錄
+                cursor.execute(_OPEN_LOGIN_SQL, (now, user.id, now))
+                if cursor.rowcount == 0:
+                    conn.rollback()
+                    return LOGIN_LOCKED, user, None
+                
+                token, expires_at = issue_token(user)
+                cursor.execute(_INSERT_SESSION_SQL, (user.id, session_key(token), ip_address, user_agent, expires_at))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        
+        login_log_writer.log(user.id, username, ip_address, user_agent, True)
+        # last_login 已變更
+        user_cache.invalidate(user.id)
+        return LOGIN_OK, user, token
+    
+    @staticmethod
+    def is_locked(username):
+        """檢查帳號是否被鎖定"""
+        user = User.get_by_username(username, ('id', 'locked_until'))
+        if not user or not user.locked_until:
+            return False
+        
+        try:
+            locked_until = datetime.fromisoformat(user.locked_until.replace('Z', '+00:00'))
+            if datetime.now() < locked_until:
+                return True
+            else:
+                # 解鎖帳號
+                with get_connection() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute(_UNLOCK_SQL, (username,))
+                    conn.commit()
+                return False
+        except:
+            return False
+    
+    @staticmethod
+    def set_reset_token(username, token, expires_at):
+        """設置密碼重置 token"""
+        with get_connection() as conn:
+            cursor = conn.cursor()
+        
+            # 將 datetime 轉換為字串格式存儲
+            expires_str = expires_at.isoformat() if hasattr(expires_at, 'isoformat') else str(expires_at)
+            cursor.execute(_SET_RESET_TOKEN_SQL, (token, expires_str, username))
+        
+            conn.commit()
+    
+    @staticmethod
+    def get_by_reset_token(token, columns=RESET_COLUMNS):
+        """根據重置 token 獲取用戶"""
+        return User._fetch_one(_BY_RESET_TOKEN, (token,), columns)
+    
+    @staticmethod
+    def get_all(columns=None):
+        """獲取所有用戶"""
+        columns, select = _select_columns(columns)
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            # 刻意讀取整個 users 表，不列入 INDEXED_QUERIES
+            cursor.execute(f'SELECT {select} FROM users')
+            rows = cursor.fetchall()
+        
+        return [User.from_row(columns, row) for row in rows]
+    
+    @staticmethod
+    def list_version():
+        """用戶列表的版本號（新增、刪除用戶或修改用戶名、email 時遞增）"""
+        with get_connection() as conn:
+            row = conn.execute(_LIST_VERSION_SQL).fetchone()
+        return row[0] if row else 0
+    
+    @staticmethod
+    def get_page(after=0, limit=100):
+        """以 id 為游標分頁取得公開欄位，返回 id 大於 after 的最多 limit 筆"""
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(_PAGE_SQL, (after, limit))
+            rows = cursor.fetchall()
+        
+        return list(map(User.list_row_to_dict, rows))
+    
+    @staticmethod
+    def iter_public(after=0, chunk_size=500):
+        """以 fetchmany 逐批讀取公開欄位，適合串流輸出"""
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(_ITER_SQL, (after,))
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield from map(User.list_row_to_dict, rows)
+    
+    @staticmethod
+    def save_session(user_id, token, ip_address=None, user_agent=None, expires_at=None):
+        """保存 Session"""
+        with get_connection() as conn:
+            cursor = conn.cursor()
+        
+            cursor.execute(_INSERT_SESSION_SQL, (user_id, session_key(token), ip_address, user_agent, expires_at))
+        
+            conn.commit()
+    
+    @staticmethod
+    def delete_session(token):
+        """刪除 Session"""
+        with get_connection() as conn:
+            cursor = conn.cursor()
+        
+            cursor.execute(_DELETE_SESSION_SQL, (session_key(token),))
+        
+            conn.commit()
+    
+    @staticmethod
+    def get_session_by_token(token):
+        """根據 token 獲取 Session"""
+        with get_connection() as conn:
+            cursor = conn.cursor()
+        
+            cursor.execute(_SESSION_SQL, (session_key(token),))
+            row = cursor.fetchone()
+        
+        if row:
+            # 檢查是否過期
+            if row[1]:
+                try:
+                    expires_at = datetime.fromisoformat(row[1].replace('Z', '+00:00'))
+                    if datetime.now() > expires_at:
+                        User.delete_session(token)
+                        return None
+                except:
+                    pass
+            return {'user_id': row[0], 'token': token}
+        return None
+
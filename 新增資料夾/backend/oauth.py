@@ -0,0 +1,246 @@
+"""
+OAuth 登入驗證模組
+在本地以快取的公鑰驗證第三方 ID token，避免每次登入都呼叫外部 API
+
+requests、rsa 與 google-auth 匯入成本高，只在第一次取得公鑰時才載入，不拖慢啟動
+"""
+import base64
+import json
+import os
+import re
+import threading
+import time
+
+import tracing
+
+# 對外 HTTP 呼叫的逾時秒數（連線, 讀取）
+OAUTH_HTTP_TIMEOUT = (
+    float(os.environ.get('OAUTH_CONNECT_TIMEOUT', 3)),
+    float(os.environ.get('OAUTH_READ_TIMEOUT', 5))
+)
+
+# Google 設定；GOOGLE_CERTS_URL 可改為本地的替代伺服器以便測試
+GOOGLE_CLIENT_ID = os.environ.get('GOOGLE_CLIENT_ID', '')
+GOOGLE_CERTS_URL = os.environ.get('GOOGLE_CERTS_URL', 'https://www.googleapis.com/oauth2/v1/certs')
+GOOGLE_ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+
+# Apple 設定；APPLE_KEYS_URL 可改為本地的替代伺服器以便測試
+APPLE_CLIENT_ID = os.environ.get('APPLE_CLIENT_ID', '')
+APPLE_KEYS_URL = os.environ.get('APPLE_KEYS_URL', 'https://appleid.apple.com/auth/keys')
+APPLE_ISSUERS = ('https://appleid.apple.com',)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class KeyFetchError(Exception):
+    """無法取得或解析提供者的公鑰"""
+
+
+def http_session():
+    """共用且具連線池的 requests.Session"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+
+def _max_age(cache_control):
+    """從 Cache-Control 標頭取得 max-age 秒數"""
+    match = re.search(r'max-age=(\d+)', cache_control or '')
+    return int(match.group(1)) if match else None
+
+
+def _b64decode(segment):
+    return base64.urlsafe_b64decode(segment + '=' * (-len(segment) % 4))
+
+
+def _split_token(token):
+    """拆解 JWT 為 (標頭, claims, 簽名內容, 簽名)，不驗證簽名"""
+    try:
+        header_segment, payload_segment, signature_segment = token.split('.')
+        header = json.loads(_b64decode(header_segment))
+        claims = json.loads(_b64decode(payload_segment))
+        signature = _b64decode(signature_segment)
+        signed = f'{header_segment}.{payload_segment}'.encode('ascii')
+    except (ValueError, TypeError, AttributeError):
+        raise ValueError('無效的 token 格式')
+    # 標頭與 claims 必須是 JSON 物件，否則後續的 .get() 會拋出非 ValueError 的例外
+    if not isinstance(header, dict) or not isinstance(claims, dict):
+        raise ValueError('無效的 token 格式')
+    return header, claims, signed, signature
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def verify_rs256(token, keys, audience, issuers, leeway=60):
+    """以快取中已解析的公鑰驗證 RS256 簽名與標準 claims，返回 claims
+
+    audience（client ID）為必要設定：未設定時拒絕所有 token，
+    否則任何為其他應用簽發的合法 token 都能登入。
+    """
+    if not audience:
+        raise ValueError('未設定 client ID，無法驗證 token 接收者')
+    header, claims, signed, signature = _split_token(token)
+    if header.get('alg') != 'RS256':
+        raise ValueError('不支援的簽名演算法')
+    if not isinstance(header.get('kid'), str):
+        raise ValueError('無效的 token 標頭')
+
+    verifier = keys.get(header['kid'])
+    if verifier is None:
+        raise ValueError('找不到對應的公鑰')
+    if not verifier.verify(signed, signature):
+        raise ValueError('token 簽名無效')
+
+    if not _is_number(claims.get('exp')) or ('iat' in claims and not _is_number(claims['iat'])):
+        raise ValueError('無效的 token 時間')
+    now = time.time()
+    if now > claims['exp'] + leeway:
+        raise ValueError('token 已過期')
+    if 'iat' in claims and claims['iat'] > now + leeway:
+        raise ValueError('token 簽發時間無效')
+    if claims.get('iss') not in issuers:
+        raise ValueError('token 發行者不正確')
+    claim_audience = claims.get('aud')
+    audiences = claim_audience if isinstance(claim_audience, list) else [claim_audience]
+    if audience not in audiences:
+        raise ValueError('token 接收者不正確')
+    return claims
+
+
+class KeyCache:
+    """以 kid 為鍵的公鑰快取
+
+    依回應的 Cache-Control 決定有效期限，接近到期時在背景更新（期間繼續使用舊的公鑰），
+    遇到未知的 kid 時立即重新取得（有最短間隔限制，避免被偽造的 kid 放大對外請求）。
+    提前更新的時間不超過有效期限的一半，且同一時間只有一個背景更新。
+    """
+
+    def __init__(self, url, parse=None, default_ttl=3600, refresh_ahead=300,
+                 max_stale=86400, min_refresh_interval=30):
+        self.url = url
+        self.parse = parse or (lambda data: data)
+        self.default_ttl = default_ttl
+        self.refresh_ahead = refresh_ahead
+        self.max_stale = max_stale
+        self.min_refresh_interval = min_refresh_interval
+        self._keys = {}
+        self._expires_at = 0.0
+        self._ttl = default_ttl
+        self._last_refresh = 0.0
+        self._refresh_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._refreshing = False
+        self.refreshes = 0
+        self.failures = 0
+
+    def refresh(self):
+        """立即重新取得公鑰"""
+        with self._refresh_lock:
+            self._last_refresh = time.time()
+            try:
+                with tracing.span('oauth.fetch_keys'):
+                    response = http_session().get(self.url, timeout=OAUTH_HTTP_TIMEOUT)
+                response.raise_for_status()
+                keys = self.parse(response.json())
+            except Exception as e:
+                self.failures += 1
+                raise KeyFetchError(f'無法取得公鑰: {e}') from e
+            ttl = _max_age(response.headers.get('Cache-Control')) or self.default_ttl
+            self._keys = keys
+            self._ttl = ttl
+            self._expires_at = time.time() + ttl
+            self.refreshes += 1
+        return keys
+
+    def _refresh_in_background(self):
+        with self._state_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            except Exception:
+                pass  # 保留舊的公鑰，下次存取時再試
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name='oauth-key-refresh', daemon=True).start()
+
+    def get_keys(self):
+        """返回目前的公鑰集合，必要時更新"""
+        now = time.time()
+        if not self._keys or now >= self._expires_at + self.max_stale:
+            return self.refresh()
+        if now >= self._expires_at - min(self.refresh_ahead, self._ttl / 2):
+            self._refresh_in_background()
+        return self._keys
+
+    def get(self, kid):
+        """取得指定 kid 的公鑰，不存在時嘗試重新取得一次"""
+        keys = self.get_keys()
+        if kid not in keys and time.time() - self._last_refresh >= self.min_refresh_interval:
+            keys = self.refresh()
+        return keys.get(kid)
+
+    def stats(self):
+        return {
+            'keys': len(self._keys),
+            'expires_in': max(0.0, self._expires_at - time.time()),
+            'refreshes': self.refreshes,
+            'failures': self.failures
+        }
+
+
+def _parse_google_certs(data):
+    """Google 的 v1 certs 格式為 {kid: PEM 憑證}，預先解析成驗證器"""
+    from google.auth import crypt
+    return {kid: crypt.RSAVerifier.from_string(pem) for kid, pem in data.items()}
+
+
+google_keys = KeyCache(GOOGLE_CERTS_URL, _parse_google_certs)
+
+
+def email_verified(claims):
+    """提供者是否已驗證 token 中的 email（Apple 以字串 "true" 表示）"""
+    return claims.get('email_verified') in (True, 'true')
+
+
+def verify_google_id_token(token):
+    """在本地驗證 Google ID token 並返回 claims，驗證失敗時拋出 ValueError"""
+    return verify_rs256(token, google_keys, GOOGLE_CLIENT_ID, GOOGLE_ISSUERS)
+
+
+def _parse_jwks(data):
+    """將 JWKS 中的 RSA 公鑰（n, e）預先解析成驗證器"""
+    import rsa
+    from google.auth import crypt
+    keys = {}
+    for jwk in data.get('keys', []):
+        if jwk.get('kty') != 'RSA' or 'kid' not in jwk:
+            continue
+        n = int.from_bytes(_b64decode(jwk['n']), 'big')
+        e = int.from_bytes(_b64decode(jwk['e']), 'big')
+        keys[jwk['kid']] = crypt.RSAVerifier.from_string(rsa.PublicKey(n, e).save_pkcs1())
+    return keys
+
+
+apple_keys = KeyCache(APPLE_KEYS_URL, _parse_jwks)
+
+
+def verify_apple_identity_token(token):
+    """在本地驗證 Apple identity token 並返回 claims，驗證失敗時拋出 ValueError"""
+    return verify_rs256(token, apple_keys, APPLE_CLIENT_ID, APPLE_ISSUERS)
@@ -0,0 +1,120 @@
+"""
+取樣分析模組
+由營運人員臨時開啟：背景執行緒定期擷取所有執行緒的呼叫堆疊，在固定時間後輸出
+collapsed stack 格式（每行「堆疊 次數」），可直接交給 flamegraph.pl 或 speedscope 產生火焰圖
+
+觸發方式：
+- 訊號：設定 PROFILE_SIGNAL（例如 SIGUSR2），對 worker 進程送出該訊號即取樣 PROFILE_SECONDS 秒
+- 受保護的端點：設定 PROFILE_TOKEN 後可呼叫 POST /api/admin/profile
+"""
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+PROFILE_SIGNAL = os.environ.get('PROFILE_SIGNAL', '')  # 留空代表不註冊訊號
+PROFILE_SECONDS = float(os.environ.get('PROFILE_SECONDS', 30))
+PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS', 300))
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.01))  # 取樣間隔秒數
+PROFILE_DIR = os.environ.get(
+    'PROFILE_DIR', os.path.join(os.path.dirname(__file__), '..', 'logs', 'profiles')
+)
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    path = code.co_filename.replace('\\', '/').split('/')
+    name = getattr(code, 'co_qualname', code.co_name)
+    # collapsed 格式以 ; 分隔堆疊、以空白分隔次數，名稱中不可出現這兩個字元
+    return f'{name} ({"/".join(path[-2:])}:{code.co_firstlineno})'.replace(';', ':').replace(' ', '_')
+
+
+class SamplingProfiler:
+    """同一時間只允許一次取樣"""
+
+    def __init__(self, interval=PROFILE_INTERVAL, output_dir=PROFILE_DIR):
+        self.interval = interval
+        self.output_dir = output_dir
+        self._lock = threading.Lock()
+        self._thread = None
+        self.last_output = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds=PROFILE_SECONDS):
+        """開始背景取樣，返回輸出檔路徑；已有取樣進行中時返回 None"""
+        seconds = max(0.1, min(float(seconds), PROFILE_MAX_SECONDS))
+        with self._lock:
+            if self.running:
+                return None
+            os.makedirs(self.output_dir, exist_ok=True)
+            stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+            path = os.path.abspath(os.path.join(self.output_dir, f'profile-{os.getpid()}-{stamp}.collapsed'))
+            self._thread = threading.Thread(
+                target=self._run, args=(seconds, path), name='sampling-profiler', daemon=True
+            )
+            self._thread.start()
+        return path
+
+    def _sample(self, stacks, own_ident, thread_names):
+        frames = sys._current_frames()
+        if not thread_names.keys() >= frames.keys():
+            # 有新的執行緒（例如 gthread 新增的請求執行緒）時才重新列舉名稱
+            thread_names.update((thread.ident, thread.name) for thread in threading.enumerate())
+        for ident, frame in frames.items():
+            if ident == own_ident:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            labels.append(thread_names.get(ident, f'thread-{ident}').replace(' ', '_').replace(';', ':'))
+            stacks[';'.join(reversed(labels))] += 1
+
+    def _run(self, seconds, path):
+        own_ident = threading.get_ident()
+        stacks = Counter()
+        samples = 0
+        deadline = time.monotonic() + seconds
+        # 以執行緒名稱作為堆疊的根，方便區分請求執行緒、bcrypt 工作池與背景工作
+        thread_names = {}
+        while time.monotonic() < deadline:
+            self._sample(stacks, own_ident, thread_names)
+            samples += 1
+            time.sleep(self.interval)
+
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for stack, count in stacks.most_common():
+                f.write(f'{stack} {count}\n')
+        os.replace(temp_path, path)
+        self.last_output = path
+        logger.warning('取樣分析完成：%d 次取樣，輸出 %s', samples, path)
+
+
+profiler = SamplingProfiler()
+
+
+def install_signal_handler():
+    """註冊 PROFILE_SIGNAL 的處理函式（必須在主執行緒呼叫；gunicorn 在 post_worker_init 呼叫）"""
+    if not PROFILE_SIGNAL:
+        return False
+    name = PROFILE_SIGNAL.upper()
+    signum = getattr(signal, name if name.startswith('SIG') else f'SIG{name}', None)
+    if not isinstance(signum, signal.Signals):
+        raise ValueError(f'不支援的 PROFILE_SIGNAL: {PROFILE_SIGNAL}')
+
+    def handle(_signum, _frame):
+        # 訊號處理函式只負責啟動背景執行緒，不在此執行任何耗時工作
+        profiler.start(PROFILE_SECONDS)
+
+    signal.signal(signum, handle)
+    return True
@@ -0,0 +1,187 @@
+"""
+登錄速率限制模組
+以 token bucket 依 IP 與用戶名限制請求，在任何資料庫或 bcrypt 運算之前拒絕濫用者
+"""
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+# 限制設定，格式為「次數/秒數」（可由環境變數覆寫，留空代表停用）
+LOGIN_RATE_IP = os.environ.get('LOGIN_RATE_IP', '20/60')
+LOGIN_RATE_USER = os.environ.get('LOGIN_RATE_USER', '10/300')
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', 100000))
+# 設定後改用此路徑的共享記憶體檔案（例如 /dev/shm/npc-ratelimit），讓多個 worker 共用狀態
+RATE_LIMIT_SHARED_PATH = os.environ.get('RATE_LIMIT_SHARED_PATH', '')
+RATE_LIMIT_SHARED_SLOTS = int(os.environ.get('RATE_LIMIT_SHARED_SLOTS', 65536))
+
+
+def parse_rate(spec):
+    """將「次數/秒數」解析為 (burst, 每秒補充量)，空字串返回 None"""
+    if not spec:
+        return None
+    count, _, seconds = spec.partition('/')
+    count = int(count)
+    seconds = float(seconds or 1)
+    if count <= 0 or seconds <= 0:
+        raise ValueError(f'無效的速率設定: {spec}')
+    return count, count / seconds
+
+
+class TokenBucketLimiter:
+    """進程內 token bucket，每個鍵只保存 (剩餘 token, 更新時間)
+
+    閒置到 bucket 補滿的鍵沒有保存的必要，會依 LRU 順序被淘汰。
+    """
+
+    def __init__(self, burst, rate, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.burst = burst
+        self.rate = rate
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.rejected = 0
+
+    def _evict(self, now):
+        # 最久未使用的鍵在前面，已補滿的代表閒置，可直接丟棄
+        idle_after = self.burst / self.rate
+        while self._buckets:
+            key, (_, updated) = next(iter(self._buckets.items()))
+            if now - updated < idle_after and len(self._buckets) <= self.max_keys:
+                break
+            del self._buckets[key]
+
+    def hit(self, key):
+        """消耗一個 token，允許時返回 0，否則返回需等待的秒數"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.pop(key, None)
+            if bucket is None:
+                tokens = self.burst
+            else:
+                tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                self.allowed += 1
+                retry_after = 0
+            else:
+                self._buckets[key] = (tokens, now)
+                self.rejected += 1
+                retry_after = (1 - tokens) / self.rate
+            self._evict(now)
+            return retry_after
+
+    def stats(self):
+        with self._lock:
+            return {'keys': len(self._buckets), 'allowed': self.allowed, 'rejected': self.rejected}
+
+
+class SharedTokenBucketLimiter:
+    """以 mmap 共享檔案實作的跨進程 token bucket
+
+    固定數量的槽位直接以鍵的雜湊定址（記憶體用量固定）；槽位被其他鍵佔用且尚未閒置時
+    兩者共用同一個 bucket，只會更嚴格而不會放寬限制。跨進程以 lockf 分段鎖保護。
+    """
+
+    _SLOT = struct.Struct('<Qdd')  # 鍵雜湊、剩餘 token、更新時間（time.time）
+    _STRIPES = 64
+
+    def __init__(self, path, burst, rate, slots=RATE_LIMIT_SHARED_SLOTS, namespace=''):
+        # fcntl 只存在於 POSIX 系統；只有設定共享路徑時才匯入，Windows 上仍可使用進程內的限制器
+        import fcntl
+        self._fcntl = fcntl
+        self.burst = burst
+        self.rate = rate
+        self.slots = slots
+        self.namespace = namespace.encode('utf-8')
+        size = slots * self._SLOT.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        # fcntl 鎖只在進程之間互斥，同進程的執行緒另外用執行緒鎖
+        self._thread_locks = [threading.Lock() for _ in range(self._STRIPES)]
+        self.allowed = 0
+        self.rejected = 0
+
+    def _hash(self, key):
+        digest = hashlib.blake2b(self.namespace + key.encode('utf-8'), digest_size=8).digest()
+        return int.from_bytes(digest, 'little') or 1
+
+    def hit(self, key):
+        """消耗一個 token，允許時返回 0，否則返回需等待的秒數"""
+        key_hash = self._hash(key)
+        index = key_hash % self.slots
+        offset = index * self._SLOT.size
+        stripe = index % self._STRIPES
+        now = time.time()
+        with self._thread_locks[stripe]:
+            self._fcntl.lockf(self._fd, self._fcntl.LOCK_EX, 1, stripe)
+            try:
+                stored_hash, tokens, updated = self._SLOT.unpack_from(self._map, offset)
+                if stored_hash == 0:
+                    tokens = self.burst
+                else:
+                    tokens = min(self.burst, tokens + max(0.0, now - updated) * self.rate)
+                    if stored_hash != key_hash and tokens >= self.burst:
+                        # 原佔用者已閒置，直接讓給新鍵
+                        tokens = self.burst
+                if tokens >= 1:
+                    tokens -= 1
+                    retry_after = 0
+                else:
+                    retry_after = (1 - tokens) / self.rate
+                self._SLOT.pack_into(self._map, offset, key_hash, tokens, now)
+            finally:
+                self._fcntl.lockf(self._fd, self._fcntl.LOCK_UN, 1, stripe)
+        if retry_after:
+            self.rejected += 1
+        else:
+            self.allowed += 1
+        return retry_after
+
+    def stats(self):
+        return {'slots': self.slots, 'allowed': self.allowed, 'rejected': self.rejected}
+
+
+def create_limiter(spec, namespace):
+    """依設定建立限制器；spec 為空時返回 None（停用）"""
+    rate = parse_rate(spec)
+    if rate is None:
+        return None
+    burst, per_second = rate
+    if RATE_LIMIT_SHARED_PATH:
+        return SharedTokenBucketLimiter(
+            f'{RATE_LIMIT_SHARED_PATH}-{namespace}', burst, per_second, namespace=namespace
+        )
+    return TokenBucketLimiter(burst, per_second)
+
+
+class LoginRateLimiter:
+    """登錄路徑的 IP 與用戶名雙重限制"""
+
+    def __init__(self, ip_spec=LOGIN_RATE_IP, user_spec=LOGIN_RATE_USER):
+        self.by_ip = create_limiter(ip_spec, 'ip')
+        self.by_user = create_limiter(user_spec, 'user')
+
+    def check(self, ip_address, username):
+        """返回 0 代表允許，否則為建議的 Retry-After 秒數"""
+        if self.by_ip is not None and ip_address:
+            retry_after = self.by_ip.hit(ip_address)
+            if retry_after:
+                return retry_after
+        if self.by_user is not None and username:
+            retry_after = self.by_user.hit(username.lower())
+            if retry_after:
+                return retry_after
+        return 0
+
+    def stats(self):
+        return {
+            'ip': self.by_ip.stats() if self.by_ip is not None else None,
+            'user': self.by_user.stats() if self.by_user is not None else None
+        }
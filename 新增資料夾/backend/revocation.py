@@ -0,0 +1,120 @@
+"""
+Token 撤銷模組
+以記憶體中的撤銷清單判斷 token 是否已登出，每次請求只需一次字典查找、不需 I/O；
+清單在啟動時從 revoked_tokens 表載入，之後依自增 id 增量同步其他 worker 的撤銷紀錄
+"""
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 增量同步間隔（秒）；0 代表不同步，撤銷只在本進程與之後啟動的進程生效
+REVOCATION_SYNC_INTERVAL = float(os.environ.get('REVOCATION_SYNC_INTERVAL', 2))
+
+_LOAD_SQL = 'SELECT id, jti, expires_at FROM revoked_tokens WHERE expires_at > ?'
+_LAST_ID_SQL = 'SELECT COALESCE(MAX(id), 0) FROM revoked_tokens'
+_SYNC_SQL = 'SELECT id, jti, expires_at FROM revoked_tokens WHERE id > ? ORDER BY id'
+_INSERT_SQL = 'INSERT OR IGNORE INTO revoked_tokens (jti, expires_at) VALUES (?, ?)'
+
+# 必須走索引的語句（名稱, SQL, 範例參數），由 migrations.find_full_scans 檢查
+INDEXED_QUERIES = [
+    ('RevocationList.load', _LOAD_SQL, (0,)),
+    ('RevocationList.load_last_id', _LAST_ID_SQL, ()),
+    ('RevocationList.sync', _SYNC_SQL, (0,)),
+    ('RevocationList.revoke', _INSERT_SQL, ('', 0)),
+]
+
+
+class RevocationList:
+    """已撤銷 token 的 jti 清單（jti → token 的 exp），token 過期後自動移除"""
+
+    def __init__(self, get_connection, sync_interval=REVOCATION_SYNC_INTERVAL):
+        self._get_connection = get_connection
+        self.sync_interval = sync_interval
+        self._revoked = {}
+        self._last_id = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.loaded = False
+        self.syncs = 0
+        self.revocations = 0
+
+    def _apply(self, rows):
+        """加入新的撤銷紀錄並移除已過期的項目（呼叫者持有鎖）"""
+        now = time.time()
+        for row_id, jti, expires_at in rows:
+            if expires_at > now:
+                self._revoked[jti] = expires_at
+            self._last_id = max(self._last_id, row_id)
+        expired = [jti for jti, expires_at in self._revoked.items() if expires_at <= now]
+        for jti in expired:
+            del self._revoked[jti]
+
+    def load(self):
+        """從資料庫載入所有尚未過期的撤銷紀錄"""
+        with self._get_connection() as conn:
+            rows = conn.execute(_LOAD_SQL, (time.time(),)).fetchall()
+            last_id = conn.execute(_LAST_ID_SQL).fetchone()[0]
+        with self._lock:
+            self._revoked.clear()
+            self._apply(rows)
+            self._last_id = max(self._last_id, last_id)
+            self.loaded = True
+
+    def sync(self):
+        """只讀取上次同步之後新增的紀錄，返回新增筆數"""
+        with self._get_connection() as conn:
+            rows = conn.execute(_SYNC_SQL, (self._last_id,)).fetchall()
+        with self._lock:
+            self._apply(rows)
+            self.syncs += 1
+        return len(rows)
+
+    def revoke(self, jti, expires_at):
+        """撤銷 token：立即在本進程生效，並寫入資料庫供其他 worker 同步"""
+        if expires_at <= time.time():
+            return
+        with self._get_connection() as conn:
+            conn.execute(_INSERT_SQL, (jti, expires_at))
+            conn.commit()
+        with self._lock:
+            self._revoked[jti] = expires_at
+            self.revocations += 1
+
+    def is_revoked(self, jti):
+        return jti in self._revoked
+
+    def _run(self):
+        while not self._stop.wait(self.sync_interval):
+            try:
+                self.sync()
+            except Exception:
+                logger.exception('同步撤銷清單失敗')
+
+    def start(self):
+        """載入撤銷清單並啟動背景同步執行緒（sync_interval 為 0 時只載入）"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self.load()
+        if self.sync_interval <= 0:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='revocation-sync', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._revoked),
+                'last_id': self._last_id,
+                'syncs': self.syncs,
+                'revocations': self.revocations
+            }
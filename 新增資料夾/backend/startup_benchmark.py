@@ -0,0 +1,119 @@
+"""
+啟動時間基準測試
+每次在全新的子進程中量測模組匯入（-X importtime）、create_app 與第一個請求的延遲；
+超出預算或啟動時載入了應延遲匯入的模組時以非零狀態結束，可放入 CI 防止啟動時間退化
+
+用法：python startup_benchmark.py [--runs 5] [--budget-ms 600] [--first-request-budget-ms 100] [--top 10]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# 只在第一次使用時才應載入的模組（OAuth 提供者相關）
+LAZY_MODULES = ('requests', 'rsa', 'google.auth')
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def child():
+    """子進程：量測一次冷啟動，結果以 JSON 輸出到 stdout"""
+    started = time.perf_counter()
+    import app as app_module
+    imported = time.perf_counter()
+    application = app_module.create_app(start_background=False)
+    created = time.perf_counter()
+    response = application.test_client().post('/api/guest-login')
+    first_request = time.perf_counter()
+
+    print(json.dumps({
+        'import_ms': (imported - started) * 1000,
+        'create_app_ms': (created - imported) * 1000,
+        'first_request_ms': (first_request - created) * 1000,
+        'first_request_status': response.status_code,
+        'eager_modules': [name for name in LAZY_MODULES if name in sys.modules]
+    }))
+
+
+def parse_importtime(stderr):
+    """解析 -X importtime 輸出，返回 {頂層套件: 自身耗時微秒}"""
+    totals = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        package = name.strip().split('.')[0]
+        totals[package] = totals.get(package, 0) + int(self_us)
+    return totals
+
+
+def run_once(database_path):
+    env = dict(os.environ, DATABASE_PATH=database_path, SWEEP_INTERVAL='0')
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', os.path.abspath(__file__), '--child'],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    sample = json.loads(result.stdout.strip().splitlines()[-1])
+    sample['packages'] = parse_importtime(result.stderr)
+    return sample
+
+
+def main():
+    parser = argparse.ArgumentParser(description='後端啟動時間基準測試')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=float(os.environ.get('STARTUP_BUDGET_MS', 600)),
+                        help='匯入 + create_app 的中位數上限')
+    parser.add_argument('--first-request-budget-ms', type=float,
+                        default=float(os.environ.get('FIRST_REQUEST_BUDGET_MS', 100)))
+    parser.add_argument('--top', type=int, default=10, help='列出匯入耗時最高的套件數')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child()
+        return 0
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_path = os.path.join(directory, 'users.db')
+        # 第一次執行會建立資料庫並套用遷移，之後的執行量測已遷移資料庫的冷啟動
+        migration = run_once(database_path)
+        samples = [run_once(database_path) for _ in range(args.runs)]
+
+    startup = statistics.median(s['import_ms'] + s['create_app_ms'] for s in samples)
+    first_request = statistics.median(s['first_request_ms'] for s in samples)
+    print(f'全新資料庫：import={migration["import_ms"]:.1f} ms  create_app={migration["create_app_ms"]:.1f} ms')
+    print(f'中位數（{args.runs} 次）：import={statistics.median(s["import_ms"] for s in samples):.1f} ms  '
+          f'create_app={statistics.median(s["create_app_ms"] for s in samples):.1f} ms  '
+          f'first_request={first_request:.1f} ms')
+
+    packages = {}
+    for sample in samples:
+        for package, us in sample['packages'].items():
+            packages.setdefault(package, []).append(us)
+    print('匯入耗時最高的套件：')
+    ranked = sorted(packages.items(), key=lambda item: statistics.median(item[1]), reverse=True)
+    for package, timings in ranked[:args.top]:
+        print(f'  {package:24s} {statistics.median(timings) / 1000:8.1f} ms')
+
+    failures = []
+    if startup > args.budget_ms:
+        failures.append(f'啟動時間 {startup:.1f} ms 超過預算 {args.budget_ms} ms')
+    if first_request > args.first_request_budget_ms:
+        failures.append(f'第一個請求 {first_request:.1f} ms 超過預算 {args.first_request_budget_ms} ms')
+    eager = sorted({name for s in samples for name in s['eager_modules']})
+    if eager:
+        failures.append(f'啟動時載入了應延遲匯入的模組: {", ".join(eager)}')
+    if any(s['first_request_status'] != 200 for s in samples):
+        failures.append('第一個請求失敗')
+
+    for failure in failures:
+        print(f'失敗：{failure}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
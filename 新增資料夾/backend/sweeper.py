@@ -0,0 +1,147 @@
+"""
+過期資料清理模組
+定期以小批次刪除過期 Session 與撤銷紀錄並清除過期的密碼重置 token，避免長時間持有寫鎖
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# 清理設定（可由環境變數覆寫）
+SWEEP_INTERVAL = float(os.environ.get('SWEEP_INTERVAL', 300))  # 秒，0 代表停用
+SWEEP_BATCH_SIZE = int(os.environ.get('SWEEP_BATCH_SIZE', 500))
+SWEEP_BATCH_PAUSE = float(os.environ.get('SWEEP_BATCH_PAUSE', 0.05))  # 批次之間的間隔秒數
+SWEEP_MAX_BATCHES = int(os.environ.get('SWEEP_MAX_BATCHES', 100))  # 單次執行的批次上限
+# 清理後的空間回收：none、incremental（需 auto_vacuum=INCREMENTAL）或 full
+SWEEP_VACUUM = os.environ.get('SWEEP_VACUUM', 'none')
+SWEEP_VACUUM_PAGES = int(os.environ.get('SWEEP_VACUUM_PAGES', 1000))
+
+_DELETE_SESSIONS_SQL = '''
+    DELETE FROM sessions WHERE id IN (
+        SELECT id FROM sessions WHERE expires_at < ? LIMIT ?
+    )
+'''
+
+_DELETE_REVOCATIONS_SQL = '''
+    DELETE FROM revoked_tokens WHERE id IN (
+        SELECT id FROM revoked_tokens WHERE expires_at < ? LIMIT ?
+    )
+'''
+
+_CLEAR_RESET_TOKENS_SQL = '''
+    UPDATE users SET reset_token = NULL, reset_token_expires = NULL WHERE id IN (
+        SELECT id FROM users
+        WHERE reset_token IS NOT NULL AND reset_token_expires < ?
+        LIMIT ?
+    )
+'''
+
+# 必須走索引的語句（名稱, SQL, 範例參數），由 migrations.find_full_scans 檢查
+INDEXED_QUERIES = [
+    ('ExpirySweeper.sessions', _DELETE_SESSIONS_SQL, ('', 1)),
+    ('ExpirySweeper.revocations', _DELETE_REVOCATIONS_SQL, (0, 1)),
+    ('ExpirySweeper.reset_tokens', _CLEAR_RESET_TOKENS_SQL, ('', 1)),
+]
+
+
+class ExpirySweeper:
+    """背景過期資料清理器"""
+
+    def __init__(self, get_connection, interval=SWEEP_INTERVAL, batch_size=SWEEP_BATCH_SIZE,
+                 pause=SWEEP_BATCH_PAUSE, max_batches=SWEEP_MAX_BATCHES, vacuum=SWEEP_VACUUM):
+        if vacuum not in ('none', 'incremental', 'full'):
+            raise ValueError(f'不支援的 SWEEP_VACUUM: {vacuum}')
+        self._get_connection = get_connection
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.max_batches = max_batches
+        self.vacuum = vacuum
+        self._stop = threading.Event()
+        self._thread = None
+        self.runs = 0
+        self.last_run = None
+        self.total_sessions = 0
+        self.total_reset_tokens = 0
+        self.total_revocations = 0
+
+    def _purge(self, sql, now):
+        """以小批次重複執行，每批各自提交，返回處理的列數"""
+        total = 0
+        for _ in range(self.max_batches):
+            with self._get_connection() as conn:
+                cursor = conn.execute(sql, (now, self.batch_size))
+                conn.commit()
+                count = cursor.rowcount
+            total += count
+            if count < self.batch_size or self._stop.is_set():
+                break
+            time.sleep(self.pause)
+        return total
+
+    def _reclaim_space(self):
+        with self._get_connection() as conn:
+            if self.vacuum == 'full':
+                conn.execute('VACUUM')
+            elif conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+                conn.execute(f'PRAGMA incremental_vacuum({SWEEP_VACUUM_PAGES})').fetchall()
+            else:
+                logger.warning('incremental_vacuum 需要 auto_vacuum=INCREMENTAL，已略過')
+
+    def run_once(self):
+        """執行一次清理，返回本次清除的列數統計"""
+        started = time.perf_counter()
+        now = datetime.now().isoformat()
+        sessions = self._purge(_DELETE_SESSIONS_SQL, now)
+        reset_tokens = self._purge(_CLEAR_RESET_TOKENS_SQL, now)
+        # 撤銷紀錄的到期時間為 Unix 秒數
+        revocations = self._purge(_DELETE_REVOCATIONS_SQL, int(time.time()))
+        if self.vacuum != 'none' and (sessions or reset_tokens or revocations):
+            self._reclaim_space()
+
+        result = {
+            'sessions': sessions,
+            'reset_tokens': reset_tokens,
+            'revocations': revocations,
+            'duration_seconds': time.perf_counter() - started
+        }
+        self.runs += 1
+        self.last_run = result
+        self.total_sessions += sessions
+        self.total_reset_tokens += reset_tokens
+        self.total_revocations += revocations
+        logger.info('清理過期資料：sessions=%d reset_tokens=%d revocations=%d',
+                    sessions, reset_tokens, revocations)
+        return result
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception('清理過期資料失敗')
+
+    def start(self):
+        """啟動背景清理執行緒（interval 為 0 時不啟動）"""
+        if self.interval <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='expiry-sweeper', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self):
+        return {
+            'runs': self.runs,
+            'last_run': self.last_run,
+            'total_sessions': self.total_sessions,
+            'total_reset_tokens': self.total_reset_tokens,
+            'total_revocations': self.total_revocations
+        }
@@ -0,0 +1,18 @@
+"""
+pytest 共用設定
+後端模組以平面方式互相匯入（import models），測試時把 backend/ 加入 sys.path；
+資料庫指向暫存目錄，避免寫入 database/users.db
+"""
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+if 'DATABASE_PATH' not in os.environ:
+    _database_dir = tempfile.mkdtemp(prefix='npc-test-')
+    atexit.register(shutil.rmtree, _database_dir, ignore_errors=True)
+    os.environ['DATABASE_PATH'] = os.path.join(_database_dir, 'users.db')
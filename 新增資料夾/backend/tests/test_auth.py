@@ -0,0 +1,75 @@
+"""
+登錄流程測試
+bcrypt 工作池滿載時的 503、舊 SHA256 雜湊在登錄後的背景升級，以及登出後快取中的 token 失效
+"""
+import hashlib
+import secrets
+
+import pytest
+
+import app as app_module
+import auth
+from models import User
+
+
+@pytest.fixture
+def client():
+    return app_module.create_app(start_background=False).test_client()
+
+
+@pytest.fixture
+def legacy_user(client):
+    """以舊的 SHA256 雜湊建立的用戶，返回 (username, password)"""
+    username = f'auth_{secrets.token_hex(4)}'
+    password = 'secret1'
+    User.create(username, hashlib.sha256(password.encode()).hexdigest(), None)
+    return username, password
+
+
+def test_login_returns_503_when_password_pool_is_full(client, legacy_user, monkeypatch):
+    pool = auth.PasswordWorkerPool(workers=1, queue_size=0)
+    monkeypatch.setattr(auth, 'password_pool', pool)
+    assert pool._slots.acquire(blocking=False)  # 佔住唯一的名額
+    try:
+        username, password = legacy_user
+        response = client.post('/api/login', json={'username': username, 'password': password})
+    finally:
+        pool._slots.release()
+    assert response.status_code == 503
+    assert int(response.headers['Retry-After']) >= 1
+    assert pool.stats()['rejected'] == 1
+
+
+def test_login_upgrades_legacy_sha256_hash(client, legacy_user, monkeypatch):
+    pool = auth.PasswordWorkerPool(workers=1, queue_size=1)
+    monkeypatch.setattr(auth, 'password_pool', pool)
+    monkeypatch.setattr(auth, 'BCRYPT_ROUNDS', 4)  # 測試用的低工作因子
+    username, password = legacy_user
+    response = client.post('/api/login', json={'username': username, 'password': password})
+    assert response.status_code == 200
+    pool._executor.shutdown(wait=True)  # 等待背景重新雜湊完成
+    pool._executor = None
+
+    stored = User.get_by_username(username, columns=('password',)).password
+    assert stored.startswith('$2b$04$')
+    assert not auth.needs_rehash(stored)
+    assert client.post('/api/login', json={'username': username, 'password': password}).status_code == 200
+
+
+def test_logout_revokes_cached_token(client, legacy_user, monkeypatch):
+    monkeypatch.setattr(auth, 'BCRYPT_ROUNDS', 4)
+    username, password = legacy_user
+    token = client.post('/api/login', json={'username': username, 'password': password}).get_json()['token']
+    headers = {'Authorization': f'Bearer {token}'}
+
+    assert client.get('/api/auth/verify', headers=headers).status_code == 200
+    payload = auth.token_cache.get(token)
+    hits = auth.token_cache.stats()['hits']
+    assert client.get('/api/auth/verify', headers=headers).status_code == 200
+    assert auth.token_cache.stats()['hits'] == hits + 1  # 第二次驗證直接命中快取
+
+    assert client.post('/api/logout', headers=headers).status_code == 200
+    assert client.get('/api/auth/verify', headers=headers).status_code == 401
+    # 其他 worker 的快取仍可能留有這個 token，撤銷清單必須擋下
+    auth.token_cache.put(token, payload)
+    assert client.get('/api/auth/verify', headers=headers).status_code == 401
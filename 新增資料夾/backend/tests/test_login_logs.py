@@ -0,0 +1,45 @@
+"""
+登錄日誌測試
+登錄日誌只在登錄交易提交成功後才排入佇列
+"""
+import secrets
+
+import pytest
+
+import models
+from models import User, LOGIN_INVALID, LOGIN_OK
+
+
+def _log_rows(username):
+    models.login_log_writer.flush()
+    with models.get_connection() as conn:
+        return conn.execute(
+            'SELECT success FROM login_logs WHERE username = ? ORDER BY id', (username,)
+        ).fetchall()
+
+
+@pytest.fixture
+def username():
+    models.init_db()
+    name = f'log_user_{secrets.token_hex(4)}'
+    User.create(name, 'hash')
+    return name
+
+
+def test_failed_session_insert_leaves_no_success_log(username):
+    def issue_token(user):
+        raise RuntimeError('簽發失敗')
+
+    with pytest.raises(RuntimeError):
+        User.authenticate_and_open_session(username, lambda hashed: True, issue_token)
+    assert _log_rows(username) == []
+
+
+def test_logs_are_written_after_commit(username):
+    status, _, _ = User.authenticate_and_open_session(username, lambda hashed: False, None)
+    assert status == LOGIN_INVALID
+    status, _, _ = User.authenticate_and_open_session(
+        username, lambda hashed: True, lambda user: ('token-' + username, '2999-01-01T00:00:00')
+    )
+    assert status == LOGIN_OK
+    assert _log_rows(username) == [(0,), (1,)]
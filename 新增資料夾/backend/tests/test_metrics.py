@@ -0,0 +1,59 @@
+"""
+指標輸出測試
+確認各子系統 stats() 的統計會出現在 /metrics
+"""
+import os
+import threading
+
+import app as app_module
+import metrics
+
+
+def test_subsystem_stats_are_exported():
+    client = app_module.create_app(start_background=False).test_client()
+    client.post('/api/register', json={'username': 'metrics_user', 'password': 'secret1'})
+    token = client.post('/api/login', json={'username': 'metrics_user', 'password': 'secret1'}).get_json()['token']
+    for _ in range(2):
+        client.get('/api/auth/verify', headers={'Authorization': f'Bearer {token}'})
+
+    body = client.get('/metrics').get_data(as_text=True)
+    for line in (
+        'npc_db_pool_checkouts_total ',
+        'npc_bcrypt_pending ',
+        'npc_token_cache_requests_total{result="hit"} ',
+        'npc_login_log_dropped_total ',
+        'npc_sweeper_deleted_total{kind="sessions"} ',
+        'npc_user_cache_invalidations_total ',
+        'npc_rate_limit_requests_total{limiter="ip",result="allowed"} ',
+    ):
+        assert line in body
+
+
+def test_concurrent_flushes_do_not_collide(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, 'METRICS_DIR', str(tmp_path))
+    errors = []
+
+    def flush_repeatedly():
+        try:
+            for _ in range(50):
+                metrics.registry.flush()
+                metrics.render()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=flush_repeatedly) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    # 只留下本進程的快照，沒有殘留的暫存檔
+    assert [p.name for p in tmp_path.iterdir()] == [f'worker-{os.getpid()}.json']
+
+
+def test_scrape_survives_unwritable_metrics_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, 'METRICS_DIR', str(tmp_path / 'missing'))
+    client = app_module.create_app(start_background=False).test_client()
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert 'npc_db_pool_checkouts_total ' in response.get_data(as_text=True)
@@ -0,0 +1,26 @@
+"""
+User 模型查詢測試
+"""
+import secrets
+
+import pytest
+
+import models
+from models import User
+
+
+@pytest.fixture(scope='module', autouse=True)
+def database():
+    models.init_db()
+
+
+def test_fetch_without_id_column_still_builds_user():
+    username = f'models_{secrets.token_hex(4)}'
+    created = User.create(username, 'hash', 'm@example.com')
+    user = User.get_by_username(username, columns=('username', 'email'))
+    assert (user.id, user.username, user.email) == (created.id, username, 'm@example.com')
+
+
+def test_unknown_column_is_rejected():
+    with pytest.raises(ValueError):
+        User.get_by_username('anyone', columns=('id', 'password; DROP TABLE users'))
@@ -0,0 +1,246 @@
+"""
+OAuth ID token 本地驗證測試
+以 http.server 在本機提供產生的 RSA 公鑰，取代 Google 的 certs 端點
+"""
+import base64
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+import rsa
+
+import oauth
+
+CLIENT_ID = 'test-client.apps.googleusercontent.com'
+ISSUER = 'https://accounts.google.com'
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def make_token(private_key, kid, claims=None, header=None, **overrides):
+    """以指定的私鑰簽發 RS256 token；claims 預設為有效的 Google ID token"""
+    now = int(time.time())
+    payload = {
+        'iss': ISSUER,
+        'aud': CLIENT_ID,
+        'sub': '1234567890',
+        'email': 'alice@example.com',
+        'email_verified': True,
+        'iat': now,
+        'exp': now + 3600
+    } if claims is None else dict(claims)
+    payload.update(overrides)
+    header = {'alg': 'RS256', 'kid': kid} if header is None else header
+    signed = f'{_b64encode(json.dumps(header).encode())}.{_b64encode(json.dumps(payload).encode())}'
+    signature = rsa.sign(signed.encode('ascii'), private_key, 'SHA-256')
+    return f'{signed}.{_b64encode(signature)}'
+
+
+class KeyServer:
+    """本機的公鑰伺服器；body 與 Cache-Control 可在測試中替換，requests 記錄被請求的次數"""
+
+    def __init__(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests += 1
+                body = json.dumps(server.body).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('Cache-Control', server.cache_control)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.body = {}
+        self.cache_control = 'public, max-age=3600'
+        self.requests = 0
+        self._httpd = HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self._httpd.server_port}/certs'
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+def google_certs(**keys):
+    """Google v1 certs 格式：{kid: PEM}"""
+    return {kid: public_key.save_pkcs1().decode('ascii') for kid, public_key in keys.items()}
+
+
+@pytest.fixture(scope='module')
+def key_pairs():
+    # 測試用的短金鑰，只為了加快產生速度
+    return [rsa.newkeys(1024) for _ in range(3)]
+
+
+@pytest.fixture
+def server(key_pairs):
+    key_server = KeyServer()
+    key_server.body = google_certs(key1=key_pairs[0][0])
+    yield key_server
+    key_server.close()
+
+
+@pytest.fixture
+def cache(server):
+    return oauth.KeyCache(server.url, oauth._parse_google_certs, min_refresh_interval=0)
+
+
+def verify(token, cache, audience=CLIENT_ID):
+    return oauth.verify_rs256(token, cache, audience, oauth.GOOGLE_ISSUERS)
+
+
+def test_valid_token(key_pairs, cache):
+    claims = verify(make_token(key_pairs[0][1], 'key1'), cache)
+    assert claims['sub'] == '1234567890'
+    assert oauth.email_verified(claims)
+
+
+def test_bad_signature(key_pairs, cache):
+    # 以另一把私鑰簽名，但宣稱是 key1
+    with pytest.raises(ValueError):
+        verify(make_token(key_pairs[1][1], 'key1'), cache)
+
+
+def test_wrong_audience(key_pairs, cache):
+    with pytest.raises(ValueError):
+        verify(make_token(key_pairs[0][1], 'key1', aud='another-client'), cache)
+
+
+def test_wrong_issuer(key_pairs, cache):
+    with pytest.raises(ValueError):
+        verify(make_token(key_pairs[0][1], 'key1', iss='https://evil.example.com'), cache)
+
+
+def test_expired_token(key_pairs, cache):
+    with pytest.raises(ValueError):
+        verify(make_token(key_pairs[0][1], 'key1', exp=int(time.time()) - 3600), cache)
+
+
+def test_missing_client_id_rejects_every_token(key_pairs, cache):
+    with pytest.raises(ValueError):
+        verify(make_token(key_pairs[0][1], 'key1'), cache, audience='')
+
+
+def test_unknown_kid_triggers_refetch(key_pairs, server, cache):
+    verify(make_token(key_pairs[0][1], 'key1'), cache)
+    assert server.requests == 1
+
+    # 提供者輪替公鑰：快取尚未過期，但新 token 的 kid 不在快取中
+    server.body = google_certs(key1=key_pairs[0][0], key2=key_pairs[2][0])
+    claims = verify(make_token(key_pairs[2][1], 'key2'), cache)
+    assert claims['aud'] == CLIENT_ID
+    assert server.requests == 2
+
+
+def test_unknown_kid_refetch_is_rate_limited(key_pairs, server):
+    cache = oauth.KeyCache(server.url, oauth._parse_google_certs, min_refresh_interval=60)
+    verify(make_token(key_pairs[0][1], 'key1'), cache)
+    for _ in range(3):
+        with pytest.raises(ValueError):
+            verify(make_token(key_pairs[2][1], 'forged'), cache)
+    assert server.requests == 1
+
+
+def test_short_max_age_does_not_refresh_on_every_call(key_pairs, server, cache):
+    # max-age 小於 refresh_ahead（300 秒）時，不應每次驗證都在背景重新取得
+    server.cache_control = 'public, max-age=100'
+    token = make_token(key_pairs[0][1], 'key1')
+    for _ in range(20):
+        verify(token, cache)
+    time.sleep(0.2)
+    assert server.requests == 1
+
+
+APPLE_CLIENT_ID = 'com.example.npc'
+APPLE_ISSUER = 'https://appleid.apple.com'
+
+
+def apple_jwks(**keys):
+    """Apple 的 JWKS 格式"""
+    return {'keys': [
+        {
+            'kty': 'RSA', 'kid': kid, 'use': 'sig', 'alg': 'RS256',
+            'n': _b64encode(public_key.n.to_bytes((public_key.n.bit_length() + 7) // 8, 'big')),
+            'e': _b64encode(public_key.e.to_bytes((public_key.e.bit_length() + 7) // 8, 'big'))
+        }
+        for kid, public_key in keys.items()
+    ]}
+
+
+@pytest.fixture
+def apple(key_pairs, server, monkeypatch):
+    server.body = apple_jwks(apple1=key_pairs[0][0])
+    monkeypatch.setattr(oauth, 'apple_keys', oauth.KeyCache(server.url, oauth._parse_jwks, min_refresh_interval=0))
+    monkeypatch.setattr(oauth, 'APPLE_CLIENT_ID', APPLE_CLIENT_ID)
+    private_key = key_pairs[0][1]
+
+    def token(**overrides):
+        claims = {'iss': APPLE_ISSUER, 'aud': APPLE_CLIENT_ID, 'email_verified': 'true', **overrides}
+        return make_token(private_key, 'apple1', **claims)
+    return token
+
+
+def test_apple_valid_token(apple):
+    claims = oauth.verify_apple_identity_token(apple())
+    assert claims['iss'] == APPLE_ISSUER
+    assert oauth.email_verified(claims)
+
+
+def test_apple_wrong_audience(apple):
+    with pytest.raises(ValueError):
+        oauth.verify_apple_identity_token(apple(aud='com.example.other'))
+
+
+def test_apple_missing_client_id_rejects_every_token(apple, monkeypatch):
+    monkeypatch.setattr(oauth, 'APPLE_CLIENT_ID', '')
+    with pytest.raises(ValueError):
+        oauth.verify_apple_identity_token(apple())
+
+
+def _segments(*parts):
+    return '.'.join(_b64encode(part) for part in parts)
+
+
+@pytest.mark.parametrize('token', [
+    'not-a-token',
+    _segments(b'[1, 2]', b'{}', b'sig'),   # 標頭不是 JSON 物件
+    _segments(b'{}', b'null', b'sig'),     # claims 不是 JSON 物件
+    _segments(b'\xff', b'{}', b'sig'),     # 標頭不是 UTF-8
+    12345,
+])
+def test_apple_malformed_token(apple, token):
+    with pytest.raises(ValueError):
+        oauth.verify_apple_identity_token(token)
+
+
+def test_apple_non_string_kid(apple, key_pairs):
+    token = make_token(key_pairs[0][1], None, header={'alg': 'RS256', 'kid': ['apple1']},
+                       iss=APPLE_ISSUER, aud=APPLE_CLIENT_ID)
+    with pytest.raises(ValueError):
+        oauth.verify_apple_identity_token(token)
+
+
+@pytest.mark.parametrize('claims', [{'exp': 'soon'}, {'exp': None}, {'exp': True}, {'iat': 'now'}])
+def test_apple_invalid_time_claims(apple, claims):
+    with pytest.raises(ValueError):
+        oauth.verify_apple_identity_token(apple(**claims))
+
+
+def test_apple_route_rejects_malformed_token_with_401(apple):
+    import app as app_module
+    client = app_module.create_app(start_background=False).test_client()
+    token = _segments(b'"header"', b'"claims"', b'sig')
+    response = client.post('/api/oauth/apple', json={'identity_token': token})
+    assert response.status_code == 401
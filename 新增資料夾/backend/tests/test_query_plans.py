@@ -0,0 +1,39 @@
+"""
+查詢計畫測試
+在遷移後的暫存資料庫上以 EXPLAIN QUERY PLAN 檢查實際執行的 SQL，確保不會全表掃描
+"""
+import sqlite3
+
+import models
+import revocation
+import sweeper
+import user_cache
+from migrations import find_full_scans, migrate
+
+
+def test_no_full_scans(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'plans.db')
+    try:
+        migrate(conn)
+        assert find_full_scans(conn, models.INDEXED_QUERIES) == []
+    finally:
+        conn.close()
+
+
+def test_every_sql_constant_is_checked():
+    # 新增 SQL 常數卻忘了加入 INDEXED_QUERIES 時失敗（含格式欄位的樣板除外）
+    checked = {sql for _, sql, _ in models.INDEXED_QUERIES}
+    for module in (models, sweeper, revocation, user_cache):
+        for name, value in vars(module).items():
+            if name.endswith('_SQL') and isinstance(value, str) and '{' not in value:
+                assert value in checked, f'{module.__name__}.{name} 未列入 INDEXED_QUERIES'
+
+
+def test_detects_full_scan(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'plans.db')
+    try:
+        migrate(conn)
+        offenders = find_full_scans(conn, [('users.created_at', 'SELECT id FROM users WHERE created_at = ?', ('',))])
+        assert [name for name, _ in offenders] == ['users.created_at']
+    finally:
+        conn.close()
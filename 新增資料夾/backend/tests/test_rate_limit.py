@@ -0,0 +1,101 @@
+"""
+登錄速率限制測試
+以可控制的時鐘測試 token bucket 的補充與淘汰，並測試 /api/login 的 429 回應
+"""
+import importlib.util
+
+import pytest
+
+import app as app_module
+import rate_limit
+
+
+class FakeClock:
+    """取代 rate_limit 模組中的 time，monotonic 與 time 都返回可手動推進的時間"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(rate_limit, 'time', fake)
+    return fake
+
+
+def test_parse_rate():
+    assert rate_limit.parse_rate('10/5') == (10, 2.0)
+    assert rate_limit.parse_rate('') is None
+    with pytest.raises(ValueError):
+        rate_limit.parse_rate('0/60')
+
+
+def test_bucket_refills_over_time(clock):
+    limiter = rate_limit.TokenBucketLimiter(burst=2, rate=1.0)
+    assert limiter.hit('k') == 0
+    assert limiter.hit('k') == 0
+    assert limiter.hit('k') == pytest.approx(1.0)
+
+    clock.now += 0.5
+    assert limiter.hit('k') == pytest.approx(0.5)
+    clock.now += 0.5
+    assert limiter.hit('k') == 0
+    assert limiter.stats() == {'keys': 1, 'allowed': 3, 'rejected': 2}
+
+
+def test_idle_keys_are_evicted(clock):
+    limiter = rate_limit.TokenBucketLimiter(burst=2, rate=1.0)
+    limiter.hit('a')
+    clock.now += 5  # 超過補滿所需的 2 秒，a 已閒置
+    limiter.hit('b')
+    assert limiter.stats()['keys'] == 1
+
+
+def test_max_keys_evicts_least_recently_used(clock):
+    limiter = rate_limit.TokenBucketLimiter(burst=5, rate=0.1, max_keys=2)
+    for key in ('a', 'b', 'c'):
+        limiter.hit(key)
+    assert list(limiter._buckets) == ['b', 'c']
+
+
+@pytest.mark.skipif(importlib.util.find_spec('fcntl') is None, reason='共享限制器需要 fcntl（POSIX）')
+def test_shared_limiter_is_shared_between_instances(clock, tmp_path):
+    path = str(tmp_path / 'ratelimit')
+    first = rate_limit.SharedTokenBucketLimiter(path, burst=2, rate=1.0, slots=64, namespace='ip')
+    second = rate_limit.SharedTokenBucketLimiter(path, burst=2, rate=1.0, slots=64, namespace='ip')
+    assert first.hit('1.2.3.4') == 0
+    assert second.hit('1.2.3.4') == 0
+    # 兩個實例（相當於兩個 worker）共用同一個 bucket
+    assert first.hit('1.2.3.4') == pytest.approx(1.0)
+    clock.now += 1
+    assert second.hit('1.2.3.4') == 0
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app_module, 'login_rate_limiter', rate_limit.LoginRateLimiter('2/60', ''))
+    return app_module.create_app(start_background=False).test_client()
+
+
+def test_login_returns_429_with_retry_after(client):
+    for _ in range(2):
+        response = client.post('/api/login', json={'username': 'nobody', 'password': 'x'})
+        assert response.status_code == 401
+    response = client.post('/api/login', json={'username': 'nobody', 'password': 'x'})
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) == 30
+
+
+@pytest.mark.parametrize('payload', [
+    {'username': 123, 'password': 'x'},
+    {'username': 'nobody', 'password': ['x']},
+])
+def test_login_rejects_non_string_credentials(client, payload):
+    assert client.post('/api/login', json=payload).status_code == 400
@@ -0,0 +1,22 @@
+"""
+啟動時間測試
+以 startup_benchmark 在子進程中量測冷啟動：不可提早載入 OAuth 相關模組，匯入 + create_app 須在預算內
+"""
+import os
+import statistics
+
+import startup_benchmark
+
+STARTUP_BUDGET_MS = float(os.environ.get('STARTUP_BUDGET_MS', 600))
+
+
+def test_cold_start_within_budget(tmp_path):
+    database_path = str(tmp_path / 'users.db')
+    startup_benchmark.run_once(database_path)  # 建立資料庫並套用遷移
+    samples = [startup_benchmark.run_once(database_path) for _ in range(3)]
+
+    for sample in samples:
+        assert sample['eager_modules'] == []
+        assert sample['first_request_status'] == 200
+    startup = statistics.median(s['import_ms'] + s['create_app_ms'] for s in samples)
+    assert startup <= STARTUP_BUDGET_MS, f'啟動時間 {startup:.1f} ms 超過預算 {STARTUP_BUDGET_MS} ms'
@@ -0,0 +1,109 @@
+"""
+用戶資料快取測試
+包含進程內的 put/get、寫入時失效，以及以版本號偵測其他連線（其他 worker）寫入的路徑
+"""
+import secrets
+import sqlite3
+
+import pytest
+
+import models
+import user_cache as user_cache_module
+from models import User, PUBLIC_COLUMNS
+from user_cache import UserCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+def test_put_get_and_ttl(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(user_cache_module, 'time', clock)
+    cache = UserCache(max_size=10, ttl=30, coherence='none')
+    user = User(1, 'alice', email='a@example.com')
+    cache.put(user)
+    assert cache.get(1) is user
+    clock.now += 31
+    assert cache.get(1) is None
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+
+def test_lru_eviction_and_invalidate_by_username():
+    cache = UserCache(max_size=2, ttl=30, coherence='none')
+    for user_id in (1, 2, 3):
+        cache.put(User(user_id, f'user{user_id}'))
+    assert cache.get(1) is None
+    cache.invalidate(username='user2')
+    assert cache.get(2) is None
+    assert cache.get(3).username == 'user3'
+
+
+def test_put_skips_data_read_before_an_invalidation():
+    cache = UserCache(max_size=10, ttl=30, coherence='none')
+    generation = cache.generation()
+    cache.invalidate(1)
+    cache.put(User(1, 'stale'), generation)
+    assert cache.get(1) is None
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    models.init_db()
+    cache = UserCache(max_size=100, ttl=300, coherence='version')
+    monkeypatch.setattr(models, 'user_cache', cache)
+    return cache
+
+
+@pytest.fixture
+def user():
+    return User.create(f'cache_{secrets.token_hex(4)}', 'hash', None)
+
+
+def _other_worker():
+    """模擬另一個 worker：不經過本進程連線池與快取的獨立連線"""
+    return sqlite3.connect(models.DATABASE_PATH)
+
+
+def test_invalidate_on_write(cache, user):
+    assert User.get_profile(user.id).last_login is None
+    User.record_login_success(user.username)
+    assert User.get_profile(user.id).last_login is not None
+
+
+def test_cross_connection_write_is_detected(cache, user):
+    assert User.get_profile(user.id).email is None
+    conn = _other_worker()
+    try:
+        conn.execute('UPDATE users SET email = ? WHERE id = ?', (f'{user.username}@example.com', user.id))
+        conn.commit()
+    finally:
+        conn.close()
+    assert User.get_profile(user.id).email == f'{user.username}@example.com'
+
+
+def test_unrelated_writes_keep_the_cache(cache, user):
+    other = User.create(f'cache_{secrets.token_hex(4)}', 'hash', None)
+    User.get_profile(user.id)
+    conn = _other_worker()
+    try:
+        # 其他表的寫入與其他用戶的更新都不應讓此用戶的項目失效
+        conn.execute("INSERT INTO login_logs (user_id, username, success) VALUES (?, ?, 1)", (user.id, user.username))
+        conn.execute('UPDATE users SET last_login = ? WHERE id = ?', ('2026-01-01T00:00:00', other.id))
+        conn.commit()
+    finally:
+        conn.close()
+    hits = cache.stats()['hits']
+    assert User.get_profile(user.id).id == user.id
+    assert cache.stats()['hits'] == hits + 1
+
+
+def test_cached_profile_matches_database(cache, user):
+    User.get_profile(user.id)
+    cached = User.get_profile(user.id)
+    fresh = User.get_by_id(user.id, PUBLIC_COLUMNS)
+    assert cached.to_public_dict() == fresh.to_public_dict()
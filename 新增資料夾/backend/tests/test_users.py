@@ -0,0 +1,69 @@
+"""
+/api/users 列表測試
+游標分頁的 Link 標頭，以及以用戶列表版本號產生的弱 ETag
+"""
+import hashlib
+import secrets
+
+import pytest
+
+import app as app_module
+import models
+from auth import generate_token
+from models import User
+
+
+@pytest.fixture
+def client():
+    return app_module.create_app(start_background=False).test_client()
+
+
+@pytest.fixture
+def headers():
+    # 只需要有效的 token，用戶本身不必存在
+    return {'Authorization': f'Bearer {generate_token(0, "list_reader")}'}
+
+
+def create_users(count):
+    return [
+        User.create(f'list_{secrets.token_hex(4)}', hashlib.sha256(b'secret1').hexdigest(), None)
+        for _ in range(count)
+    ]
+
+
+def test_cursor_pagination(client, headers):
+    users = create_users(3)
+    after = users[0].id - 1
+
+    response = client.get(f'/api/users?after={after}&limit=2', headers=headers)
+    assert response.status_code == 200
+    assert [user['id'] for user in response.get_json()] == [users[0].id, users[1].id]
+    assert 'password' not in response.get_json()[0]
+    assert response.headers['Link'] == f'</api/users?after={users[1].id}&limit=2>; rel="next"'
+
+    # 最後一頁不足 limit 筆，不再提供 Link
+    response = client.get(f'/api/users?after={users[1].id}&limit=2', headers=headers)
+    assert [user['id'] for user in response.get_json()] == [users[2].id]
+    assert 'Link' not in response.headers
+
+
+def test_etag_revalidation(client, headers):
+    user, = create_users(1)
+    response = client.get('/api/users', headers=headers)
+    etag = response.headers['ETag']
+    assert etag.startswith('W/')
+
+    cached = client.get('/api/users', headers={**headers, 'If-None-Match': etag})
+    assert cached.status_code == 304
+    assert cached.get_data() == b''
+
+    # 與列表無關的欄位（密碼）不改變 ETag
+    User.update_password(user.username, hashlib.sha256(b'secret2').hexdigest())
+    assert client.get('/api/users', headers={**headers, 'If-None-Match': etag}).status_code == 304
+
+    with models.get_connection() as conn:
+        conn.execute('UPDATE users SET email = ? WHERE id = ?', ('list@example.com', user.id))
+        conn.commit()
+    response = client.get('/api/users', headers={**headers, 'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
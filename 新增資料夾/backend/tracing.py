@@ -0,0 +1,135 @@
+"""
+請求追蹤模組
+每個請求在記憶體中累積 span（資料庫、bcrypt、JWT、對外 OAuth 呼叫），只有慢請求或被取樣的請求
+才以 JSON 行寫入本地輪替檔；其他請求只付出記錄 span 的成本
+"""
+import contextvars
+import json
+import logging
+import os
+import random
+import secrets
+import time
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+# 超過此毫秒數的請求一定寫入（0 代表不依耗時寫入）
+TRACE_SLOW_MS = float(os.environ.get('TRACE_SLOW_MS', 1000))
+# 額外隨機取樣的比例（0 ~ 1）
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', 0))
+# 檔案路徑，{pid} 會替換為進程 ID，避免多個 worker 同時輪替同一個檔案
+TRACE_LOG_PATH = os.environ.get(
+    'TRACE_LOG_PATH', os.path.join(os.path.dirname(__file__), '..', 'logs', 'trace-{pid}.jsonl')
+)
+TRACE_LOG_MAX_BYTES = int(os.environ.get('TRACE_LOG_MAX_BYTES', 10 * 1024 * 1024))
+TRACE_LOG_BACKUPS = int(os.environ.get('TRACE_LOG_BACKUPS', 5))
+TRACE_MAX_SPANS = 200
+
+ENABLED = TRACE_SLOW_MS > 0 or TRACE_SAMPLE_RATE > 0
+
+_current = contextvars.ContextVar('trace', default=None)
+_logger = None
+_logger_pid = None
+
+
+class Trace:
+    __slots__ = ('started', 'spans', 'dropped')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []
+        self.dropped = 0
+
+
+def begin():
+    """開始追蹤目前的請求，返回供 end() 使用的 token（停用時返回 None）"""
+    if not ENABLED:
+        return None
+    return _current.set(Trace())
+
+
+def end(token):
+    if token is not None:
+        _current.reset(token)
+
+
+def add_span(name, started, duration):
+    """記錄一個已完成的 span（started 為 perf_counter 時間）；不在追蹤中的執行緒直接返回"""
+    trace = _current.get()
+    if trace is None:
+        return
+    if len(trace.spans) < TRACE_MAX_SPANS:
+        trace.spans.append((name, started, duration))
+    else:
+        trace.dropped += 1
+
+
+class span:
+    """以 with 記錄一段程式碼的 span"""
+
+    __slots__ = ('name', 'started')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        add_span(self.name, self.started, time.perf_counter() - self.started)
+
+
+def _get_logger():
+    # 延遲建立（fork 之後才知道 pid）
+    global _logger, _logger_pid
+    pid = os.getpid()
+    if _logger is None or _logger_pid != pid:
+        path = os.path.abspath(TRACE_LOG_PATH.format(pid=pid))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handler = RotatingFileHandler(
+            path, maxBytes=TRACE_LOG_MAX_BYTES, backupCount=TRACE_LOG_BACKUPS, encoding='utf-8'
+        )
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger = logging.getLogger(f'npc.trace.{pid}')
+        logger.handlers = [handler]
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        _logger, _logger_pid = logger, pid
+    return _logger
+
+
+def finish(**fields):
+    """請求結束時呼叫：慢請求或被取樣時寫入追蹤紀錄並返回 trace ID，否則返回 None"""
+    trace = _current.get()
+    if trace is None:
+        return None
+    duration_ms = (time.perf_counter() - trace.started) * 1000
+    slow = TRACE_SLOW_MS > 0 and duration_ms >= TRACE_SLOW_MS
+    sampled = not slow and TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE
+    if not (slow or sampled):
+        return None
+
+    trace_id = secrets.token_hex(8)
+    record = {
+        'trace_id': trace_id,
+        'time': datetime.now().isoformat(),
+        'pid': os.getpid(),
+        'reason': 'slow' if slow else 'sampled',
+        'duration_ms': round(duration_ms, 3),
+        **fields,
+        'spans': [
+            {
+                'name': name,
+                'start_ms': round((started - trace.started) * 1000, 3),
+                'duration_ms': round(duration * 1000, 3)
+            }
+            for name, started, duration in trace.spans
+        ],
+        'dropped_spans': trace.dropped
+    }
+    try:
+        _get_logger().info(json.dumps(record, ensure_ascii=False))
+    except OSError:
+        return None
+    return trace_id
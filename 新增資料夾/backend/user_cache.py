@@ -0,0 +1,132 @@
+"""
+用戶資料快取模組
+進程內的 TTL + LRU 快取，寫入時失效；可選擇以觸發器維護的版本號偵測其他 worker 的寫入
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# 快取設定（可由環境變數覆寫）
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 30))  # 秒，0 代表停用
+# 跨 worker 一致性：none 只依賴 TTL；version 以 table_versions 與 users.version 驗證快取項目
+# （舊設定值 data_version 視為 version）
+USER_CACHE_COHERENCE = os.environ.get('USER_CACHE_COHERENCE', 'none')
+
+# 公開資料的全域版本號（更新公開欄位或刪除用戶時由觸發器遞增）與單一用戶的版本號
+PROFILES_VERSION_SQL = "SELECT version FROM table_versions WHERE name = 'user_profiles'"
+USER_VERSION_SQL = 'SELECT version FROM users WHERE id = ?'
+
+
+class UserCache:
+    """以用戶 ID 為鍵的讀取快取
+
+    coherence=version 時，每個項目記錄最後一次驗證時的全域版本號：全域版本號未變時直接命中；
+    變了（任何 worker 更新過任一用戶的公開資料）才以 users.version 逐筆驗證該項目，
+    其他表的寫入（登錄日誌、背景清理）不會使快取失效。
+    """
+
+    def __init__(self, max_size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL, coherence=USER_CACHE_COHERENCE):
+        if coherence == 'data_version':
+            coherence = 'version'
+        if coherence not in ('none', 'version'):
+            raise ValueError(f'不支援的 USER_CACHE_COHERENCE: {coherence}')
+        self.max_size = max_size
+        self.ttl = ttl
+        self.coherence = coherence
+        self._entries = OrderedDict()
+        self._by_username = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._generation = 0
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_size > 0
+
+    def profiles_version(self, conn):
+        """目前的全域公開資料版本號；未啟用 version 一致性時返回 None"""
+        if self.coherence != 'version':
+            return None
+        row = conn.execute(PROFILES_VERSION_SQL).fetchone()
+        return row[0] if row else 0
+
+    def get(self, user_id, conn=None, version=None):
+        """取得快取的用戶；version 為 profiles_version() 的結果，與項目記錄的不同時以 conn 驗證"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and now >= entry[1]:
+                self._remove(user_id)
+                entry = None
+        if entry is not None and version is not None and entry[2] != version:
+            # 驗證在鎖外執行；期間項目若被替換，下方只在項目未變時更新
+            row = conn.execute(USER_VERSION_SQL, (user_id,)).fetchone()
+            with self._lock:
+                if self._entries.get(user_id) is entry:
+                    if row is not None and row[0] == entry[0].version:
+                        entry = self._entries[user_id] = (entry[0], entry[1], version)
+                    else:
+                        self._remove(user_id)
+                        self.invalidations += 1
+                        entry = None
+        with self._lock:
+            if entry is not None:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            return None
+
+    def generation(self):
+        """讀取資料庫前取得世代號，期間若有失效發生，put 會放棄寫入過時資料"""
+        with self._lock:
+            return self._generation
+
+    def put(self, user, generation=None, version=None):
+        """加入快取；version 為讀取資料庫之前取得的 profiles_version()"""
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._entries[user.id] = (user, time.monotonic() + self.ttl, version)
+            self._entries.move_to_end(user.id)
+            if user.username is not None:
+                self._by_username[user.username] = user.id
+            while len(self._entries) > self.max_size:
+                _, (evicted, _, _) = self._entries.popitem(last=False)
+                if evicted.username is not None:
+                    self._by_username.pop(evicted.username, None)
+
+    def _remove(self, user_id):
+        entry = self._entries.pop(user_id, None)
+        if entry is not None and entry[0].username is not None:
+            self._by_username.pop(entry[0].username, None)
+
+    def invalidate(self, user_id=None, username=None):
+        """讓指定用戶的快取失效（依 ID 或用戶名）"""
+        with self._lock:
+            if user_id is None and username is not None:
+                user_id = self._by_username.get(username)
+            if user_id is not None:
+                self._remove(user_id)
+            self._generation += 1
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_username.clear()
+            self._generation += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations
+            }
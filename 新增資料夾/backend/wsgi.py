@@ -0,0 +1,10 @@
+"""
+生產環境 WSGI 進入點
+gunicorn -c gunicorn.conf.py wsgi:app
+
+gunicorn.conf.py 啟用 preload_app，本模組只在 master 匯入一次：資料庫遷移在 master 執行，
+worker fork 之後由 post_fork 啟動背景工作。
+"""
+from app import create_app
+
+app = create_app(start_background=False)